@@ -3,6 +3,8 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext
 from ttkthemes import ThemedTk
 import threading
 import queue
+import multiprocessing
+import concurrent.futures
 import locale
 import os
 import roman
@@ -11,6 +13,17 @@ import webbrowser
 import configparser
 import sys
 import subprocess
+import hashlib
+import glob
+import json
+import struct
+import argparse
+import itertools
+import csv
+import getpass
+import atexit
+import contextlib
+from collections import OrderedDict, deque
 
 # --- Check and Install webdriver-manager ---
 try:
@@ -71,16 +84,21 @@ if not _WEBDRIVER_MANAGER_INSTALLED:
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
+from webdriver_manager.core.os_manager import OperationSystemManager, ChromeType
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
+from selenium.common.exceptions import (TimeoutException, WebDriverException, NoSuchElementException, SessionNotCreatedException,
+                                        JavascriptException, StaleElementReferenceException)
 import time
+import requests
+import urllib3
+import lxml.html
 import pandas as pd
+import numpy as np
 import fitz
 import re
-import openpyxl
 
 # --- Constants from legacy script (or slightly adapted) ---
 MONTHS = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
@@ -91,20 +109,79 @@ MONTH_NUMBERS_MAP = {
 MONTH_NAMES_MAP_REVERSE = {v: k for k, v in MONTH_NUMBERS_MAP.items()} # For pivot table headers
 
 VENCIMENTO_CODES = ["1101"]
+VENCIMENTO_CODE_SET = set(VENCIMENTO_CODES)
 REFERENCIA_REGEX = r'Referência:\s*(\d{4})'
 CARGO_REGEX = r'Cargo:\s*([A-Z])\w*(?:\s*-\s*|\s*)([IVX]+)'
 TOTAL_PROVENTOS_TEXT = "TOTAL PROVENTOS"
+NUMBER_REGEX = r'\b\d{1,3}(?:\.\d{3})*(?:,\d{1,2})\b'
+MONEY_WORD_REGEX = re.compile(r'\d{1,3}(?:\.\d{3})*(?:,\d{1,2})')
+# One alternation per token kind, so each page is scanned once
+PAGE_TOKEN_REGEX = re.compile(
+    rf"(?P<referencia>{REFERENCIA_REGEX})"
+    rf"|(?P<cargo>(?i:{CARGO_REGEX}))"
+    rf"|(?P<proventos>{re.escape(TOTAL_PROVENTOS_TEXT)})"
+    rf"|(?P<number>{NUMBER_REGEX})"
+    r"|(?P<code>\b\d{4}\b)"
+)
 EMPTY_VALUE_MSG = "Valor vazio encontrado para {}. Pulando para o próximo mês."
 TOTAL_PROVENTOS_NOT_FOUND_MSG = "TOTAL PROVENTOS não encontrado na página {}"
-ERROR_OPENING_EXCEL_FILE_MSG = "Erro ao abrir arquivo Excel para o ano {}: {}"
+ERROR_OPENING_EXCEL_FILE_MSG = "Erro ao abrir arquivo Excel de vencimentos: {}"
 MISSING_YEARS = {
     1998: 1997, 1999: 1997, 2004: 2003,
     2007: 2006, 2008: 2006, 2011: 2010
 }
+FIRST_PDF_YEAR = 1993 # Earlier Referência years are not in the vencimentos workbook
+PDF_STOP_YEAR, PDF_STOP_MONTH = 2014, 'Mar' # The PDF is read up to this month; RHNet covers the rest
+PDF_HEADER_FRACTION = 0.2 # Top part of a page read by the pre-scan to find the Referência year
+PDF_PRESCAN_MODES = ('bisect', 'header', 'off') # Bisection assumes ascending years, as the Mar/2014 stop does
+DEFAULT_PDF_PRESCAN_MODE = 'bisect'
+DIFFERENCE_THRESHOLD = 5.0 # Max vencimento distance before the previous cargo is also checked
+EXACT_MATCH_TOLERANCE = 0.01
 SELENIUM_TIMEOUT = 15
+DEFAULT_WAIT_POLL_INTERVAL = 0.2 # Seconds between checks of a wait condition
 ORGÃO_RHNET = "309"
+RHNET_PORTAL_URL = "https://aplicacoes.expresso.go.gov.br"
+RHNET_MAX_PAGES = 300
+RHNET_HISTORY_DIR = 'rhnet_historico'
+RHNET_HISTORY_FORMAT = 1
+RHNET_SCRAPING_BACKENDS = ('http', 'selenium') # 'http' falls back to the browser if a post fails
+DEFAULT_RHNET_SCRAPING_BACKEND = 'selenium' # 'http' is opt-in until it is validated against the live RHNet
+DEFAULT_RHNET_RETRIES = 2 # Extra attempts of the RHNet stage after a browser crash or timeout
+RHNET_RETRY_DELAY = 5 # Seconds before the first retry; doubles on each further one
+# Browser crashes, timeouts and a chromedriver that stopped answering; retried from the checkpoint
+RHNET_TRANSIENT_ERRORS = (WebDriverException, urllib3.exceptions.HTTPError, ConnectionError)
+# The only ones retried before the history walk began: a timeout there may be a wrong password,
+# and logging in again with it could lock the account
+RHNET_CONNECTION_ERRORS = (urllib3.exceptions.HTTPError, ConnectionError)
+DEFAULT_BROWSER_POOL_SIZE = 0 # Logged-in browsers kept open between calculations; 0 quits after each run
+DEFAULT_BATCH_WORKERS = 2 # Servidores calculated at once by --lote
+DEFAULT_BATCH_RETRIES = 1 # Extra attempts for a servidor whose calculation failed
+BATCH_RETRY_DELAY = 5 # Seconds before the first retry; doubles on each further one
+BATCH_SUMMARY_FILE = 'resumo_lote.csv'
+DEFAULT_MATRICULA_WORKERS = 2 # Browsers scraping matrículas at once when [RHNet] all_matriculas = 1
+BROWSER_POOL_RESET_TIMEOUT = 5 # Seconds to reach the search form again before logging in anew
+BROWSER_PROFILES = ('standard', 'lean') # 'lean': eager page loads, no images/fonts/CSS/trackers
+DEFAULT_BROWSER_PROFILE = 'standard'
+LEAN_BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.css',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*',
+]
 
 CONFIG_FILE = 'config.ini'
+SALARY_CACHE_FILE = 'vencimentos_cache.bin'
+SALARY_TABLE_MAGIC = b'CHTABLE\n'
+SALARY_TABLE_FORMAT = 1
+SALARY_TABLE_ALIGNMENT = 64
+DEFAULT_CH_CACHE_SIZE = 4096
+DEFAULT_PDF_WORKERS = 0 # 0 or 1 parses the PDF pages sequentially
+PDF_PAGES_PER_TASK = 4
+PDF_EXTRACTION_MODES = ('text', 'layout') # 'layout' places values in month columns by x position
+DEFAULT_PDF_EXTRACTION_MODE = 'text'
+HEADER_ROW_TOLERANCE = 2.0 # Max y distance (pt) between month names of the same header row
+PDF_CACHE_DIR = 'fichas_cache'
+PDF_CACHE_FORMAT = 3
 
 def get_config_path():
     """Reads the Excel file path from config.ini, creating a default if it doesn't exist."""
@@ -117,6 +194,26 @@ def get_config_path():
             '# Instruções': 'Por favor, insira o caminho completo para o arquivo Excel de Vencimentos do Magistério abaixo.',
             'excel_file_path': 'C:/Caminho/Para/VENCIMENTOS MAGISTÉRIO_1993-2014.xlsx'
         }
+        config['Performance'] = {
+            'ch_cache_size': str(DEFAULT_CH_CACHE_SIZE),
+            'pdf_workers': str(DEFAULT_PDF_WORKERS),
+            'pdf_extraction_mode': DEFAULT_PDF_EXTRACTION_MODE,
+            'pdf_result_cache': '1',
+            'pdf_prescan': DEFAULT_PDF_PRESCAN_MODE
+        }
+        config['RHNet'] = {
+            'scraping_backend': DEFAULT_RHNET_SCRAPING_BACKEND,
+            'wait_timeout': str(SELENIUM_TIMEOUT),
+            'poll_interval': str(DEFAULT_WAIT_POLL_INTERVAL),
+            'incremental_history': '1',
+            'browser_pool_size': str(DEFAULT_BROWSER_POOL_SIZE),
+            'chromedriver_offline': '0',
+            'browser_profile': DEFAULT_BROWSER_PROFILE,
+            'all_matriculas': '0',
+            'matricula_workers': str(DEFAULT_MATRICULA_WORKERS),
+            'stop_at_pdf_coverage': '1',
+            'retries': str(DEFAULT_RHNET_RETRIES)
+        }
         with open(CONFIG_FILE, 'w', encoding='utf-8') as configfile:
             config.write(configfile)
         messagebox.showerror(
@@ -143,29 +240,1504 @@ def get_config_path():
         messagebox.showerror("Erro Inesperado", f"Não foi possível ler o arquivo de configuração: {e}")
         return None
 
+def read_config_option(section, option, fallback=None):
+    """Reads an optional setting from config.ini, returning fallback when it is absent."""
+    config = configparser.ConfigParser()
+    try:
+        config.read(CONFIG_FILE, encoding='utf-8')
+    except configparser.Error:
+        return fallback
+    return config.get(section, option, fallback=fallback)
+
+def unique_temp_path(path):
+    """Returns a temporary file name next to path that no other thread or process writes to."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+CONFIG_WRITE_LOCK = threading.Lock() # Matrícula lanes and batch workers may start Chrome at once
+
+def write_config_options(section, values):
+    """Stores settings in config.ini, keeping its other sections, options and comment lines.
+
+    Writes from threads of this process are serialized; each goes through its own
+    temporary file, so concurrent processes never truncate each other's output.
+    """
+    with CONFIG_WRITE_LOCK:
+        config = configparser.ConfigParser(comment_prefixes=(), allow_no_value=True, interpolation=None)
+        config.optionxform = str # Keep the case of existing keys and comments
+        config.read(CONFIG_FILE, encoding='utf-8')
+        if not config.has_section(section):
+            config.add_section(section)
+        for option, value in values.items():
+            config.set(section, option, str(value))
+        temp_path = unique_temp_path(CONFIG_FILE)
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as configfile:
+                config.write(configfile)
+            os.replace(temp_path, CONFIG_FILE)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+def read_config_int(section, option, fallback):
+    """Reads an optional integer setting from config.ini."""
+    value = read_config_option(section, option)
+    try:
+        return int(value) if value is not None else fallback
+    except ValueError:
+        print(f"Valor inválido para '{option}' em [{section}] no '{CONFIG_FILE}': {value}. Usando {fallback}.")
+        return fallback
+
+def read_config_float(section, option, fallback):
+    """Reads an optional decimal setting from config.ini."""
+    value = read_config_option(section, option)
+    try:
+        return float(value) if value is not None else fallback
+    except ValueError:
+        print(f"Valor inválido para '{option}' em [{section}] no '{CONFIG_FILE}': {value}. Usando {fallback}.")
+        return fallback
+
+def set_pt_br_locale():
+    """Sets pt_BR number and date formats (Linux or Windows names). Returns a warning when falling back to the system default."""
+    try:
+        locale.setlocale(locale.LC_NUMERIC, 'pt_BR.UTF-8')
+        locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
+    except locale.Error as e:
+        try:
+            locale.setlocale(locale.LC_NUMERIC, 'Portuguese_Brazil.1252')
+            locale.setlocale(locale.LC_TIME, 'Portuguese_Brazil.1252')
+        except locale.Error as e2:
+            locale.setlocale(locale.LC_ALL, '')
+            return f"Falha ao definir localidade pt_BR: {e} / {e2}. Usando padrão do sistema."
+    return None
+
 EXCEL_FILE_PATH = get_config_path()
 
+# --- Salary Table Index ---
+MONTH_LABELS = [m.upper() for m in MONTHS]
+SALARY_BLOCK_ROWS = 3 # Cargo row plus the two rows below it
+CH_COLUMN_INDEX = 2 # Col C (0-based, as returned by iter_rows)
+VENCIMENTO_FIRST_COLUMN_INDEX = 3 # Col D (0-based)
+
+def _cell_label(value):
+    """Returns the stripped, upper-cased text of a cell, or None for non-text cells."""
+    if isinstance(value, str):
+        return value.strip().upper()
+    return None
+
+def _cell_to_float(value):
+    """Converts a vencimento cell to float. Returns None for empty, '-' or non-numeric cells."""
+    if value is None or value == "-":
+        return None
+    try:
+        if isinstance(value, str):
+            return locale.atof(value.strip())
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def _cell_to_ch(value):
+    """Validates a CH cell (Col C). Returns the CH number or None if it is not numeric."""
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+def get_previous_cargo(cargo):
+    """Returns the cargo one level below a 'P-<roman>' cargo (e.g. 'P-III' -> 'P-II'), or None."""
+    parts = cargo.split('-')
+    if len(parts) == 2 and parts[0].upper() == 'P':
+        roman_part = parts[1].upper()
+        if roman_part != 'I':
+            current_level = roman.fromRoman(roman_part)
+            if current_level > 1:
+                return f"P-{roman.toRoman(current_level - 1)}"
+    return None
+
+def _ch_to_python(ch_value):
+    """Converts a CH taken from the float matrix back to int when it is a whole number."""
+    ch_value = float(ch_value)
+    return int(ch_value) if ch_value.is_integer() else ch_value
+
+class SalaryTable:
+    """Index of the vencimentos workbook keyed by (year, month, cargo).
+
+    Every cargo block (the cargo row and the two rows below it, from Col D onwards)
+    becomes one row of a float matrix holding its vencimento values in sheet order,
+    padded with inf, next to a matrix with the CH (Col C) of the row each value came
+    from (NaN when the CH is not numeric). Lookups resolve many months at once with
+    NumPy instead of walking worksheet cells.
+
+    A table may hold only some of the workbook's year sheets (loaded_sheets);
+    sheet_names always lists every sheet in the workbook.
+    """
+
+    def __init__(self, sheet_names, block_keys, values, ch, loaded_sheets=None, layouts=None, prev_block=None):
+        self.sheet_names = list(sheet_names)
+        self.loaded_sheets = list(self.sheet_names if loaded_sheets is None else loaded_sheets)
+        self.layouts = dict(layouts or {}) # {sheet_name: layout detected by index_sheet_rows}
+        self.block_keys = list(block_keys) # [(year, MONTH, CARGO), ...], aligned with matrix rows
+        self.block_index = {key: idx for idx, key in enumerate(self.block_keys)}
+        self.values = values
+        self.ch = ch
+        if prev_block is None:
+            prev_block = self.link_previous_cargos(self.block_keys, self.block_index)
+        self.prev_block = prev_block
+        self.version = None # SHA-256 of the workbook the table was built from
+
+    @staticmethod
+    def link_previous_cargos(block_keys, block_index):
+        """Maps every block to the block of the previous cargo level in the same sheet and month.
+
+        Returns an array aligned with block_keys holding the predecessor's matrix row,
+        or -1 when the cargo has no predecessor block.
+        """
+        prev_block = np.full(len(block_keys), -1, dtype=np.intp)
+        for idx, (year, month, cargo) in enumerate(block_keys):
+            try:
+                previous_cargo = get_previous_cargo(cargo)
+            except Exception:
+                continue # Not a valid 'P-<roman>' label
+            if previous_cargo:
+                prev_block[idx] = block_index.get((year, month, previous_cargo), -1)
+        return prev_block
+
+    @classmethod
+    def from_workbook(cls, excel_path, years=None):
+        """Streams the workbook in read-only mode and indexes the requested year sheets.
+
+        years is an iterable of sheet names; None indexes every sheet. Sheets that are
+        not requested are never parsed, so load time and memory follow the years used.
+        """
+        import openpyxl # Only needed when the cache is cold
+        wanted = None if years is None else {str(year) for year in years}
+        workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        try:
+            sheets = {}
+            layouts = {}
+            for sheet_name in workbook.sheetnames:
+                if wanted is not None and sheet_name not in wanted:
+                    continue
+                rows = list(workbook[sheet_name].iter_rows(values_only=True))
+                layouts[sheet_name] = {}
+                sheets[sheet_name] = cls.index_sheet_rows(rows, layouts[sheet_name])
+            return cls.from_sheet_blocks(sheets, workbook.sheetnames, layouts)
+        finally:
+            workbook.close()
+
+    @classmethod
+    def from_sheet_blocks(cls, sheets, sheet_names=None, layouts=None):
+        """Packs {sheet_name: {(MONTH, CARGO): [(vencimento, ch), ...]}} into the lookup matrices."""
+        block_keys = []
+        block_candidates = []
+        for sheet_name, blocks in sheets.items():
+            for (month, cargo), candidates in blocks.items():
+                block_keys.append((sheet_name, month, cargo))
+                block_candidates.append(candidates)
+
+        width = max([len(candidates) for candidates in block_candidates] + [1])
+        values = np.full((len(block_keys), width), np.inf)
+        ch = np.full((len(block_keys), width), np.nan)
+        for idx, candidates in enumerate(block_candidates):
+            for col, (value, ch_value) in enumerate(candidates):
+                values[idx, col] = value
+                if ch_value is not None:
+                    ch[idx, col] = ch_value
+        values[np.isnan(values)] = np.inf # NaN cells can never be the closest value
+        if sheet_names is None:
+            sheet_names = sheets.keys()
+        return cls(sheet_names, block_keys, values, ch, loaded_sheets=sheets.keys(), layouts=layouts)
+
+    def merged_with(self, other):
+        """Returns a table holding the sheets of both tables.
+
+        other must come from the same workbook and hold sheets not loaded in this table.
+        """
+        width = max(self.values.shape[1], other.values.shape[1])
+        def padded(matrix, fill):
+            extra = width - matrix.shape[1]
+            return np.pad(matrix, ((0, 0), (0, extra)), constant_values=fill) if extra else matrix
+        values = np.vstack([padded(self.values, np.inf), padded(other.values, np.inf)])
+        ch = np.vstack([padded(self.ch, np.nan), padded(other.ch, np.nan)])
+        loaded_sheets = self.loaded_sheets + [name for name in other.loaded_sheets if name not in self.loaded_sheets]
+        merged = SalaryTable(self.sheet_names, self.block_keys + other.block_keys, values, ch, loaded_sheets,
+                             layouts={**self.layouts, **other.layouts})
+        merged.version = self.version
+        return merged
+
+    def missing_sheets(self, years):
+        """Returns the sheets among years that exist in the workbook but are not loaded yet."""
+        return {str(year) for year in years if str(year) in self.sheet_names and str(year) not in self.loaded_sheets}
+
+    @staticmethod
+    def index_sheet_rows(rows, layout=None):
+        """Builds the (MONTH, CARGO) -> candidates map for the rows of one year sheet.
+
+        Mirrors the Col B layout search: only the first row holding a month name opens
+        that month's block, the block ends at the next month name, and the first row
+        matching a cargo inside the block is the one used. When a layout dict is given
+        it is filled with what was detected (month rows, skipped header months, width).
+        """
+        # Months laid out horizontally (month in row 1 above a 'CARGO' label in row 2)
+        # are not supported by the lookup and are left out of the index.
+        header_months = set()
+        if len(rows) >= 2:
+            for month_cell, cargo_cell in zip(rows[0], rows[1]):
+                month_label = _cell_label(month_cell)
+                if month_label in MONTH_LABELS and _cell_label(cargo_cell) == 'CARGO':
+                    header_months.add(month_label)
+
+        blocks = {}
+        month_rows = {}
+        seen_months = set()
+        current_month = None
+        for row_idx, row in enumerate(rows):
+            label = _cell_label(row[1]) if len(row) > 1 else None
+            if label is None:
+                continue
+            if label in MONTH_LABELS:
+                if label in seen_months or label in header_months:
+                    current_month = None
+                else:
+                    current_month = label
+                    month_rows[label] = row_idx + 1
+                seen_months.add(label)
+                continue
+            if current_month is None or (current_month, label) in blocks:
+                continue
+
+            candidates = []
+            for block_row in rows[row_idx:row_idx + SALARY_BLOCK_ROWS]:
+                ch = _cell_to_ch(block_row[CH_COLUMN_INDEX]) if len(block_row) > CH_COLUMN_INDEX else None
+                for cell_value in block_row[VENCIMENTO_FIRST_COLUMN_INDEX:]:
+                    value = _cell_to_float(cell_value)
+                    if value is not None:
+                        candidates.append((value, ch))
+            blocks[(current_month, label)] = candidates
+
+        if layout is not None:
+            layout['month_rows'] = month_rows
+            layout['header_months'] = sorted(header_months)
+            layout['max_column'] = max([len(row) for row in rows] + [0])
+        return blocks
+
+    def has_year(self, year):
+        return str(year) in self.sheet_names
+
+    def find_block(self, year, month, cargo):
+        """Returns the matrix row of a cargo block, or -1 if it does not exist."""
+        return self.block_index.get((str(year), month.upper(), cargo.upper()), -1)
+
+    def nearest(self, block_rows, targets):
+        """Returns (distance, ch) of the value closest to each target within its block.
+
+        Values are compared in sheet order and the first one within
+        EXACT_MATCH_TOLERANCE wins, as in the original cell-by-cell scan; otherwise
+        the first minimum. Distance is inf when the block has no numeric value.
+        """
+        distances = np.abs(self.values[block_rows] - targets[:, None])
+        close = distances < EXACT_MATCH_TOLERANCE
+        pick = np.where(close.any(axis=1), close.argmax(axis=1), distances.argmin(axis=1))
+        query_rows = np.arange(len(block_rows))
+        return distances[query_rows, pick], self.ch[block_rows, pick]
+
+    def resolve_ch_batch(self, queries, threshold=DIFFERENCE_THRESHOLD):
+        """Resolves the CH of many (year, month, cargo, vencimento) queries in one NumPy pass.
+
+        Returns one (ch, distance, matched_cargo) tuple per query. When the closest
+        value is farther than threshold, the block of the previous cargo level is
+        also searched and used if it is closer. ch is None when nothing matches.
+        """
+        results = [(None, float('inf'), None)] * len(queries)
+        if not queries:
+            return results
+
+        block_rows = np.array([self.find_block(year, month, cargo) for year, month, cargo, _ in queries], dtype=np.intp)
+        targets = np.array([vencimento for _, _, _, vencimento in queries], dtype=float)
+        found = np.flatnonzero(block_rows >= 0)
+        if not len(found):
+            return results
+
+        distances, chs = self.nearest(block_rows[found], targets[found])
+        # A closest value whose CH is not numeric counts as not found
+        resolved = np.isfinite(distances) & ~np.isnan(chs)
+        matched_cargos = [queries[q][2] for q in found]
+
+        # --- Previous cargo fallback for distances above the threshold ---
+        retry = np.flatnonzero(resolved & (distances > threshold))
+        prev_rows = self.prev_block[block_rows[found[retry]]]
+        has_prev = prev_rows >= 0
+        retry, prev_rows = retry[has_prev], prev_rows[has_prev]
+        if len(retry):
+            prev_distances, prev_chs = self.nearest(prev_rows, targets[found[retry]])
+            better = ~np.isnan(prev_chs) & (prev_distances < distances[retry])
+            distances[retry[better]] = prev_distances[better]
+            chs[retry[better]] = prev_chs[better]
+            for pos, prev_row in zip(retry[better], prev_rows[better]):
+                matched_cargos[pos] = self.block_keys[prev_row][2]
+
+        for pos, q in enumerate(found):
+            if resolved[pos]:
+                results[q] = (_ch_to_python(chs[pos]), float(distances[pos]), matched_cargos[pos])
+        return results
+
+    def save_compiled(self, path, source_signature):
+        """Writes the table as a columnar file that load_compiled can memory-map.
+
+        Layout: SALARY_TABLE_MAGIC, a little-endian uint32 header length, a JSON
+        header (workbook signature, sheet names, detected sheet layouts, cargo names
+        and array descriptors), then one aligned raw array per column: sheet, month
+        and cargo codes and the previous-cargo link per block, and the vencimento and
+        CH matrices.
+        """
+        cargo_names = sorted({cargo for _, _, cargo in self.block_keys})
+        sheet_codes = {name: code for code, name in enumerate(self.sheet_names)}
+        cargo_codes = {name: code for code, name in enumerate(cargo_names)}
+        columns = {
+            'sheet': np.array([sheet_codes[sheet] for sheet, _, _ in self.block_keys], dtype='<i2'),
+            'month': np.array([MONTH_LABELS.index(month) for _, month, _ in self.block_keys], dtype='|i1'),
+            'cargo': np.array([cargo_codes[cargo] for _, _, cargo in self.block_keys], dtype='<i2'),
+            'prev_block': np.asarray(self.prev_block, dtype='<i4'),
+            'vencimento': np.ascontiguousarray(self.values, dtype='<f8'),
+            'ch': np.ascontiguousarray(self.ch, dtype='<f8'),
+        }
+
+        arrays = {}
+        offset = 0
+        for name, column in columns.items():
+            arrays[name] = {'dtype': column.dtype.str, 'shape': list(column.shape), 'offset': offset}
+            offset += -(-column.nbytes // SALARY_TABLE_ALIGNMENT) * SALARY_TABLE_ALIGNMENT
+        header = {
+            'format': SALARY_TABLE_FORMAT, 'source': source_signature,
+            'sheet_names': self.sheet_names, 'loaded_sheets': self.loaded_sheets,
+            'layouts': self.layouts, 'cargos': cargo_names, 'months': MONTH_LABELS,
+            'block_rows': SALARY_BLOCK_ROWS, 'ch_column': CH_COLUMN_INDEX + 1,
+            'first_vencimento_column': VENCIMENTO_FIRST_COLUMN_INDEX + 1,
+            'arrays': arrays,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        prefix_size = len(SALARY_TABLE_MAGIC) + 4 + len(header_bytes)
+        data_start = -(-prefix_size // SALARY_TABLE_ALIGNMENT) * SALARY_TABLE_ALIGNMENT
+
+        temp_path = unique_temp_path(path)
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(SALARY_TABLE_MAGIC)
+                f.write(struct.pack('<I', len(header_bytes)))
+                f.write(header_bytes)
+                for name, column in columns.items():
+                    f.seek(data_start + arrays[name]['offset'])
+                    f.write(column.tobytes())
+                f.truncate(data_start + offset)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load_compiled(cls, path, source_signature=None):
+        """Memory-maps a file written by save_compiled (read-only, shared through the page cache).
+
+        Returns None if the file does not exist or, when source_signature is given,
+        if it was compiled from a different workbook.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            if f.read(len(SALARY_TABLE_MAGIC)) != SALARY_TABLE_MAGIC:
+                raise ValueError(f"'{path}' não é uma tabela de vencimentos compilada.")
+            header_size = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        if header.get('format') != SALARY_TABLE_FORMAT:
+            return None
+        if source_signature is not None and header.get('source') != source_signature:
+            return None
+
+        prefix_size = len(SALARY_TABLE_MAGIC) + 4 + header_size
+        data_start = -(-prefix_size // SALARY_TABLE_ALIGNMENT) * SALARY_TABLE_ALIGNMENT
+        columns = {}
+        for name, meta in header['arrays'].items():
+            shape = tuple(meta['shape'])
+            if int(np.prod(shape)) == 0:
+                columns[name] = np.zeros(shape, dtype=meta['dtype'])
+            else:
+                columns[name] = np.memmap(path, dtype=meta['dtype'], mode='r', offset=data_start + meta['offset'], shape=shape)
+
+        sheet_names, cargo_names = header['sheet_names'], header['cargos']
+        block_keys = [
+            (sheet_names[sheet], MONTH_LABELS[month], cargo_names[cargo])
+            for sheet, month, cargo in zip(columns['sheet'].tolist(), columns['month'].tolist(), columns['cargo'].tolist())
+        ]
+        salary_table = cls(sheet_names, block_keys, columns['vencimento'], columns['ch'],
+                           loaded_sheets=header['loaded_sheets'], layouts=header['layouts'],
+                           prev_block=columns['prev_block'])
+        salary_table.version = (header.get('source') or {}).get('sha256')
+        return salary_table
+
+class ChResolutionCache:
+    """Bounded LRU memo of CH resolutions keyed on (excel_year, lookup_month, cargo, vencimento).
+
+    Lives at module level so consecutive calculations in the same process reuse the
+    answers. Entries are tagged with the salary table version and dropped when a
+    different workbook is loaded.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.table_version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query):
+        excel_year, lookup_month, cargo, vencimento = query
+        return (str(excel_year), lookup_month.upper(), cargo.upper(), float(vencimento))
+
+    def resolve(self, salary_table, queries):
+        """Returns resolve_ch_batch results for queries, only sending cache misses to the table."""
+        if self.max_size <= 0:
+            with self.lock:
+                self.misses += len(queries)
+            return salary_table.resolve_ch_batch(queries)
+
+        keys = [self.make_key(query) for query in queries]
+        results = [None] * len(queries)
+        missing = {} # key -> positions waiting for it
+        with self.lock:
+            if salary_table.version != self.table_version:
+                self.entries.clear()
+                self.table_version = salary_table.version
+            for pos, key in enumerate(keys):
+                cached = self.entries.get(key)
+                if cached is not None:
+                    self.entries.move_to_end(key)
+                    results[pos] = cached
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(pos)
+                    self.misses += 1
+
+        if missing:
+            missing_keys = list(missing)
+            resolved = salary_table.resolve_ch_batch([queries[missing[key][0]] for key in missing_keys])
+            with self.lock:
+                for key, result in zip(missing_keys, resolved):
+                    for pos in missing[key]:
+                        results[pos] = result
+                    self.entries[key] = result
+                    self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return results
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / total) if total else 0.0
+        return f"{self.hits} acertos, {self.misses} falhas ({hit_rate:.1f}%), {len(self.entries)}/{self.max_size} entradas"
+
+CH_RESOLUTION_CACHE = ChResolutionCache(read_config_int('Performance', 'ch_cache_size', DEFAULT_CH_CACHE_SIZE))
+
+def get_salary_cache_path():
+    """Returns the path of the compiled salary table.
+
+    Defaults to a cache next to config.ini; [Paths] compiled_table_path may point to a
+    table compiled with --compilar-tabela (e.g. on a shared drive).
+    """
+    configured_path = read_config_option('Paths', 'compiled_table_path')
+    if configured_path:
+        return configured_path
+    return os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), SALARY_CACHE_FILE)
+
+def get_salary_cache_candidates(cache_path):
+    """Returns cache_path followed by the versioned tables load_salary_table saved next to it."""
+    stem, ext = os.path.splitext(cache_path)
+    return [cache_path] + sorted(glob.glob(glob.escape(stem) + '.*' + ext))
+
+def get_versioned_salary_cache_path(cache_path, salary_table):
+    """Returns the file a table extended with more sheets is saved to, next to cache_path.
+
+    Loaded tables stay memory-mapped (by earlier calculations, batch workers or other
+    processes sharing the file) and Windows cannot replace a mapped file, so every
+    extension goes to a new file named after the workbook version and its sheets.
+    """
+    key = '|'.join([salary_table.version or ''] + sorted(salary_table.loaded_sheets))
+    stem, ext = os.path.splitext(cache_path)
+    return f"{stem}.{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}{ext}"
+
+def compile_salary_table(excel_path, output_path):
+    """Compiles every sheet of the vencimentos workbook into a memory-mappable table file."""
+    print(f"Compilando tabela de vencimentos: {excel_path}")
+    start_time = time.perf_counter()
+    source_signature = get_file_signature(excel_path)
+    salary_table = SalaryTable.from_workbook(excel_path)
+    salary_table.save_compiled(output_path, source_signature)
+    print(f"{len(salary_table.block_keys)} blocos de {len(salary_table.loaded_sheets)} planilhas "
+          f"salvos em '{output_path}' ({time.perf_counter() - start_time:.1f}s).")
+
+FILE_SIGNATURE_CACHE = {} # Absolute path -> last signature computed in this process
+
+def get_file_signature(file_path):
+    """Returns the size, mtime and SHA-256 of a file, used to detect changes to the workbook.
+
+    The file is only hashed again when its size or mtime changed since the last call,
+    so the workbook and PDF are read once per process rather than on every lookup.
+    """
+    stat = os.stat(file_path)
+    cache_key = os.path.abspath(file_path)
+    signature = FILE_SIGNATURE_CACHE.get(cache_key)
+    if signature is None or signature['size'] != stat.st_size or signature['mtime_ns'] != stat.st_mtime_ns:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        FILE_SIGNATURE_CACHE[cache_key] = signature
+    return dict(signature)
+
+# --- Ficha Financeira (PDF) Parsing ---
+
+def is_row_gap(gap_text, on_label_line):
+    """Whether the text between a row's label (or last value) and a number keeps the number in that row.
+
+    Only whitespace may sit in between, except for the rest of the label's own line
+    (the description after the code).
+    """
+    if on_label_line:
+        gap_text = gap_text.partition("\n")[2]
+    return not gap_text.strip()
+
+def tokenize_page(page_text):
+    """Reads one page's text in a single regex pass and returns a structured page record.
+
+    The record holds the first Referência year and cargo found and the money values,
+    in text order, of the first row of each code in VENCIMENTO_CODES ('codes') and of
+    the TOTAL PROVENTOS row ('proventos', None when the label is missing). A row's
+    values are the numbers right after its label, on the label's line (layout text) or
+    one per line below it (fitz text), up to the first other text.
+    """
+    record = {'referencia_year': None, 'cargo': None, 'codes': {}, 'proventos': None}
+    row = None # Values of the row being read
+    row_end = 0 # End of the row's label or of its last value
+    on_label_line = False
+    for token in PAGE_TOKEN_REGEX.finditer(page_text):
+        kind = token.lastgroup
+        if kind == 'number':
+            if row is not None and is_row_gap(page_text[row_end:token.start()], on_label_line):
+                row.append(token.group())
+                row_end, on_label_line = token.end(), False
+            else:
+                row = None
+        elif kind == 'code':
+            # Other codes are plain text here: they end the row being read
+            if token.group() in VENCIMENTO_CODE_SET and token.group() not in record['codes']:
+                row = record['codes'][token.group()] = []
+                row_end, on_label_line = token.end(), True
+        elif kind == 'proventos':
+            if record['proventos'] is None:
+                row = record['proventos'] = []
+                row_end, on_label_line = token.end(), True
+        elif kind == 'referencia':
+            if record['referencia_year'] is None:
+                record['referencia_year'] = int(re.match(REFERENCIA_REGEX, token.group()).group(1))
+        elif kind == 'cargo':
+            if record['cargo'] is None:
+                cargo_match = re.match(CARGO_REGEX, token.group(), re.IGNORECASE)
+                record['cargo'] = cargo_match.group(1).upper() + "-" + cargo_match.group(2).upper()
+    return record
+
+def page_words_to_text(page_words):
+    """Joins fitz 'words' back into lines of text, in reading order."""
+    lines = {}
+    for word in page_words:
+        lines.setdefault((word[5], word[6]), []).append(word[4])
+    return "\n".join(" ".join(line_words) for line_words in lines.values())
+
+def extract_layout_vencimentos(page_words, vencimento_code, page_num, log):
+    """Builds the 12 monthly vencimentos of a page from fitz word coordinates.
+
+    The month columns come from the header row holding the month names. Each money
+    value on the vencimento code row and on the TOTAL PROVENTOS row goes to the
+    column whose header is closest in x, so blank months stay blank instead of
+    shifting the following values. Returns None if the header or rows are not found.
+    """
+    header_rows = [] # [(y, {MONTH: x})]
+    code_row = None # (y, half height, right edge of the label)
+    proventos_row = None
+    money_words = [] # (x, y, text)
+    previous_word = None
+    for x0, y0, x1, y1, text, block_no, line_no, _ in page_words:
+        x_center, y_center = (x0 + x1) / 2, (y0 + y1) / 2
+        label = text.strip().upper()
+        if label in MONTH_LABELS:
+            for row_y, row_months in header_rows:
+                if abs(row_y - y_center) <= HEADER_ROW_TOLERANCE:
+                    row_months.setdefault(label, x_center)
+                    break
+            else:
+                header_rows.append((y_center, {label: x_center}))
+        elif MONEY_WORD_REGEX.fullmatch(text):
+            money_words.append((x_center, y_center, text))
+        elif text == vencimento_code and code_row is None:
+            code_row = (y_center, (y1 - y0) / 2, x1)
+        elif label == 'PROVENTOS' and previous_word == ('TOTAL', block_no, line_no) and proventos_row is None:
+            proventos_row = (y_center, (y1 - y0) / 2, x1)
+        previous_word = (label, block_no, line_no)
+
+    header_months = max((row_months for _, row_months in header_rows), key=len, default={})
+    if len(header_months) < len(MONTH_LABELS) or code_row is None or proventos_row is None:
+        return None
+    column_x = [header_months[month] for month in MONTH_LABELS]
+
+    grid = {code_row: [None] * 12, proventos_row: [None] * 12}
+    for x_center, y_center, text in money_words:
+        for row in (code_row, proventos_row):
+            row_y, half_height, label_right = row
+            if abs(y_center - row_y) <= half_height and x_center > label_right:
+                month_idx = min(range(12), key=lambda i: abs(column_x[i] - x_center))
+                if grid[row][month_idx] is None:
+                    grid[row][month_idx] = text
+                else:
+                    log("WARNING", f"Página {page_num + 1}: Mais de um valor na coluna {MONTHS[month_idx]}. Mantendo '{grid[row][month_idx]}', ignorando '{text}'.")
+                break
+
+    vencimento_associated = []
+    for venc_num_str, provento_str in zip(grid[code_row], grid[proventos_row]):
+        try:
+            provento_val = locale.atof(provento_str) if provento_str else 0.0
+        except ValueError:
+            provento_val = 0.0
+        if provento_val == 0.0 or not venc_num_str:
+            vencimento_associated.append("0")
+            continue
+        try:
+            vencimento_associated.append(f"{locale.atof(venc_num_str):.2f}")
+        except ValueError:
+            log("WARNING", f"Página {page_num + 1}: Não foi possível converter valor de vencimento '{venc_num_str}' para número.")
+            vencimento_associated.append("0")
+    log("DEBUG", f"Página {page_num + 1}: Vencimento por coluna de mês (coordenadas): {vencimento_associated}")
+    return vencimento_associated
+
+def extract_page_record(page_text, page_num, log, page_words=None):
+    """Extracts the CH lookup inputs from the text of one ficha financeira page.
+
+    Returns (page_num, referencia_year, excel_year, cargo, 12 monthly vencimentos),
+    or None when the page is skipped. log(level, message) receives the page's log
+    lines, so the function can also run in a worker process. When page_words (fitz
+    'words') is given, months are assigned by position instead of text order.
+    """
+    log("DEBUG", f"Analisando página {page_num + 1}...")
+    page_tokens = tokenize_page(page_text)
+
+    referencia_year = page_tokens['referencia_year']
+    if referencia_year is not None:
+        log("DEBUG", f"Página {page_num + 1}: Ano de Referência = {referencia_year}")
+        if referencia_year < FIRST_PDF_YEAR:
+            log("INFO", f"Página {page_num + 1}: Ano {referencia_year} < {FIRST_PDF_YEAR}. Pulando página.")
+            return None
+    else:
+        log("WARNING", f"Referência não encontrada na página {page_num + 1}. Pulando página.")
+        return None
+
+    cargo_text = page_tokens['cargo']
+    if cargo_text:
+        log("DEBUG", f"Página {page_num + 1}: Cargo = {cargo_text}")
+    else:
+        log("WARNING", f"Cargo não encontrado na página {page_num + 1}. Pulando página.")
+        return None
+
+    # Find the first of VENCIMENTO_CODES whose row has a numeric value
+    vencimento_code = None
+    for code in VENCIMENTO_CODES:
+        code_values = page_tokens['codes'].get(code)
+        if code_values:
+            vencimento_code = code
+            vencimento_value_str = code_values[0]
+            log("DEBUG", f"Página {page_num + 1}: Código {code} encontrado. Vencimento Bruto = {vencimento_value_str} ({locale.atof(vencimento_value_str)})")
+            break
+
+    if vencimento_code is None:
+         log("DEBUG", f"Página {page_num + 1}: Nenhum código de vencimento {VENCIMENTO_CODES} encontrado com valor numérico. Pulando linha de vencimento.")
+         log("WARNING", f"Nenhum código de vencimento {VENCIMENTO_CODES} encontrado na página {page_num + 1}. Pulando página.")
+         return None
+
+    # --- Find corresponding CH in Excel ---
+    excel_year = MISSING_YEARS.get(referencia_year, referencia_year)
+    if excel_year != referencia_year:
+        log("INFO", f"Dados para {referencia_year} não encontrados no Excel. Usando dados de {excel_year}.")
+
+    # Pair the month columns of TOTAL PROVENTOS with the values after the vencimento code
+    proventos_values = page_tokens['proventos']
+    if proventos_values is None:
+        log("WARNING", TOTAL_PROVENTOS_NOT_FOUND_MSG.format(page_num + 1))
+        return None
+    if proventos_values:
+        log("DEBUG", f"Página {page_num + 1}: Total Proventos = {proventos_values[0]}")
+
+    if page_words is not None:
+        vencimento_associated = extract_layout_vencimentos(page_words, vencimento_code, page_num, log)
+        if vencimento_associated is not None:
+            return (page_num, referencia_year, excel_year, cargo_text, vencimento_associated)
+        log("WARNING", f"Página {page_num + 1}: Colunas de meses não identificadas pelas coordenadas. Usando a ordem do texto.")
+
+    vencimento_associated = []
+    proventos_numbers_on_line = proventos_values[:12]
+    vencimento_numbers_1101_line = page_tokens['codes'][vencimento_code]
+
+    proventos_numbers_on_line.extend(['0,00'] * (12 - len(proventos_numbers_on_line)))
+    proventos_numbers_on_line = proventos_numbers_on_line[:12]
+
+    venc_assoc_index = 0
+    for provento_str in proventos_numbers_on_line:
+        try:
+            provento_val = locale.atof(provento_str.strip()) if provento_str else 0.0
+        except ValueError:
+            provento_val = 0.0
+
+        if provento_val == 0.0:
+            vencimento_associated.append("0")
+        else:
+            if venc_assoc_index < len(vencimento_numbers_1101_line):
+                venc_num_str = vencimento_numbers_1101_line[venc_assoc_index].strip()
+                try:
+                    venc_float = locale.atof(venc_num_str)
+                    vencimento_associated.append(f"{venc_float:.2f}")
+                except ValueError:
+                    log("WARNING", f"Página {page_num + 1}: Não foi possível converter valor de vencimento '{venc_num_str}' para número.")
+                    vencimento_associated.append("0")
+                venc_assoc_index += 1
+            else:
+                log("WARNING", f"Página {page_num + 1}: Mais valores não-zero em PROVENTOS do que em VENCIMENTO ({vencimento_code}). Faltando dados?")
+                vencimento_associated.append("0")
+
+    # Ensure vencimento_associated has 12 entries, padding with "0" if needed
+    while len(vencimento_associated) < 12:
+        vencimento_associated.append("0")
+    vencimento_associated = vencimento_associated[:12]
+    log("DEBUG", f"Página {page_num + 1}: Vencimento Associado (por mês, baseado em proventos!=0): {vencimento_associated}")
+
+    return (page_num, referencia_year, excel_year, cargo_text, vencimento_associated)
+
+def read_header_referencia_year(page):
+    """Reads the Referência year from the header region of a page only. Returns None if not found there."""
+    page_rect = page.rect
+    header_rect = fitz.Rect(page_rect.x0, page_rect.y0, page_rect.x1, page_rect.y0 + page_rect.height * PDF_HEADER_FRACTION)
+    match = re.search(REFERENCIA_REGEX, page.get_text("text", clip=header_rect))
+    return int(match.group(1)) if match else None
+
+def extract_pdf_page(page, page_num, log, extraction_mode):
+    """Runs extract_page_record on a fitz page using the given extraction mode."""
+    if extraction_mode == 'layout':
+        page_words = page.get_text("words")
+        return extract_page_record(page_words_to_text(page_words), page_num, log, page_words)
+    return extract_page_record(page.get_text("text"), page_num, log)
+
+def _init_pdf_worker(numeric_locale):
+    """Process pool initializer: parse numbers with the same locale as the GUI process."""
+    try:
+        locale.setlocale(locale.LC_NUMERIC, numeric_locale)
+    except locale.Error:
+        pass
+
+def parse_pdf_page_range(pdf_file_path, page_nums, extraction_mode):
+    """Worker entry point: opens the PDF and extracts the records of the given pages.
+
+    Returns a list of (page_num, record or None, log messages) in page order.
+    """
+    results = []
+    with fitz.open(pdf_file_path) as pdf_document:
+        for page_num in page_nums:
+            messages = []
+            page = pdf_document.load_page(page_num)
+            record = extract_pdf_page(page, page_num, lambda level, message: messages.append((level, message)), extraction_mode)
+            results.append((page_num, record, messages))
+    return results
+
+def get_pdf_cache_dir():
+    """Returns the folder of the parsed PDF cache ([Paths] pdf_cache_dir, or next to config.ini)."""
+    configured_path = read_config_option('Paths', 'pdf_cache_dir')
+    if configured_path:
+        return configured_path
+    return os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), PDF_CACHE_DIR)
+
+class ParsedPdfCache:
+    """On-disk cache of parse_pdf results, one JSON file per PDF content hash and extraction mode.
+
+    An entry keeps the extracted page records and the Number/Date lists resolved from
+    them, together with the salary table version used. If only the workbook changed,
+    the page records are reused and just the CH resolution runs again, unless they
+    end at the Mar/2014 stop (the new table may not stop at the same page).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def entry_path(self, pdf_hash, extraction_mode):
+        return os.path.join(self.cache_dir, f"{pdf_hash}_{extraction_mode}.json")
+
+    def load(self, pdf_hash, extraction_mode):
+        """Returns the cached entry, or None if there is none in the current format."""
+        try:
+            with open(self.entry_path(pdf_hash, extraction_mode), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if entry.get('format') != PDF_CACHE_FORMAT:
+            return None
+        entry['pages'] = [tuple(record) for record in entry['pages']]
+        return entry
+
+    def save(self, pdf_hash, extraction_mode, table_version, page_records, result, stopped):
+        """Writes an entry; stopped tells that page_records end at the Mar/2014 stop, not the PDF end."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {
+            'format': PDF_CACHE_FORMAT, 'pdf_sha256': pdf_hash, 'extraction_mode': extraction_mode,
+            'table_version': table_version, 'pages': page_records, 'result': result, 'stopped': stopped,
+        }
+        path = self.entry_path(pdf_hash, extraction_mode)
+        temp_path = unique_temp_path(path)
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def clear(self):
+        """Deletes every cached entry and returns how many were removed."""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+
+def consume_stream(stream, consumer):
+    """Passes every item of a generator to consumer(*item) and returns the generator's return value."""
+    while True:
+        try:
+            item = next(stream)
+        except StopIteration as stop:
+            return stop.value
+        consumer(*item)
+
+# --- RHNet Page Waits ---
+
+class WaitPolicy:
+    """Timeout and polling interval of every explicit wait on RHNet ([RHNet] wait_timeout / poll_interval)."""
+
+    def __init__(self, timeout=SELENIUM_TIMEOUT, poll_interval=DEFAULT_WAIT_POLL_INTERVAL):
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_config(cls):
+        return cls(read_config_float('RHNet', 'wait_timeout', SELENIUM_TIMEOUT),
+                   read_config_float('RHNet', 'poll_interval', DEFAULT_WAIT_POLL_INTERVAL))
+
+class PageWaiter:
+    """Runs WebDriver waits under a WaitPolicy and logs the time spent on each step."""
+
+    def __init__(self, driver, policy, log):
+        self.driver = driver
+        self.policy = policy
+        self.log = log
+        self.total_seconds = 0.0
+        self.steps = 0
+
+    def until(self, condition, step):
+        """Waits until condition(driver) is truthy and returns its value; TimeoutException otherwise."""
+        start_time = time.perf_counter()
+        try:
+            return WebDriverWait(self.driver, self.policy.timeout, poll_frequency=self.policy.poll_interval).until(condition)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.total_seconds += elapsed
+            self.steps += 1
+            self.log("DEBUG", f"Espera '{step}': {elapsed:.2f}s")
+
+def select_has_options(xpath, count=2):
+    """Wait condition: the <select> at xpath lists at least count options."""
+    return lambda driver: len(Select(driver.find_element(By.XPATH, xpath)).options) >= count
+
+def select_options_changed(xpath, previous_texts):
+    """Wait condition: the <select> at xpath lists a choice and its option texts differ from previous_texts.
+
+    Returns the option texts.
+    """
+    def condition(driver):
+        try:
+            texts = [option.text.strip() for option in Select(driver.find_element(By.XPATH, xpath)).options]
+        except StaleElementReferenceException:
+            return False # List being reloaded
+        return texts if len(texts) >= 2 and texts != previous_texts else False
+    return condition
+
+def select_option_is(xpath, index, text):
+    """Wait condition: option index of the <select> at xpath reads text."""
+    def condition(driver):
+        try:
+            options = Select(driver.find_element(By.XPATH, xpath)).options
+            return len(options) > index and options[index].text.strip() == text
+        except StaleElementReferenceException:
+            return False # List being reloaded
+    return condition
+
+def input_has_value(element, value):
+    """Wait condition: the input element holds value."""
+    return lambda driver: element.get_attribute('value') == value
+
+# --- Chrome / chromedriver ---
+
+def detect_chrome_version():
+    """Returns the installed Chrome version as reported by the OS (no network access), or None."""
+    try:
+        return OperationSystemManager().get_browser_version_from_os(ChromeType.GOOGLE)
+    except Exception:
+        return None
+
+def build_chrome_options(profile):
+    """Chrome options for the RHNet browser. 'lean' trades page rendering for faster page loads."""
+    options = webdriver.ChromeOptions()
+    if profile == 'lean':
+        options.add_argument("--headless=new")
+        options.page_load_strategy = 'eager' # Return once the DOM is ready, without waiting for subresources
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-default-apps")
+        options.add_argument("--disable-sync")
+        options.add_argument("--no-first-run")
+        options.add_argument("--mute-audio")
+        options.add_argument("--disable-features=Translate,OptimizationHints,MediaRouter")
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+    else:
+        options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument('log-level=3')
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    return options
+
+# --- Browser Pool ---
+
+class BrowserPool:
+    """Logged-in Chrome drivers kept open between calculations, so a run skips Chrome start-up and login.
+
+    Drivers are parked by RHNet user: borrow() hands out the most recently parked
+    one and release() parks it again, quitting the oldest beyond max_idle. With
+    max_idle 0 nothing is parked and the caller quits the driver, as before.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max(0, max_idle)
+        self.lock = threading.Lock()
+        self.idle = deque() # (username, driver), oldest first
+
+    def borrow(self, username):
+        with self.lock:
+            for index in range(len(self.idle) - 1, -1, -1):
+                if self.idle[index][0] == username:
+                    driver = self.idle[index][1]
+                    del self.idle[index]
+                    return driver
+        return None
+
+    def release(self, username, driver):
+        """Parks a driver for later runs. Returns False (driver not kept) when the pool is disabled."""
+        if self.max_idle == 0:
+            return False
+        evicted = []
+        with self.lock:
+            self.idle.append((username, driver))
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.popleft()[1])
+        for old_driver in evicted:
+            self.quit_quietly(old_driver)
+        return True
+
+    def close_all(self):
+        with self.lock:
+            drivers = [driver for _, driver in self.idle]
+            self.idle.clear()
+        for driver in drivers:
+            self.quit_quietly(driver)
+
+    @staticmethod
+    def quit_quietly(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+BROWSER_POOL = BrowserPool(read_config_int('RHNet', 'browser_pool_size', DEFAULT_BROWSER_POOL_SIZE))
+atexit.register(BROWSER_POOL.close_all)
+
+# --- RHNet History Store ---
+
+def get_rhnet_history_dir():
+    """Returns the folder of the RHNet history store ([Paths] rhnet_history_dir, or next to config.ini)."""
+    configured_path = read_config_option('Paths', 'rhnet_history_dir')
+    if configured_path:
+        return configured_path
+    return os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), RHNET_HISTORY_DIR)
+
+class RhnetHistoryStore:
+    """Local store of the (date, vencimento efetivo) rows already scraped for one CPF and matrícula.
+
+    Past RHNet months do not change, so a later run only has to go back until the
+    newest stored month. Rows are kept newest first, by competência; the file name is a
+    hash of CPF and matrícula, so CPFs do not show up in the folder listing.
+
+    While going back, each row is also appended to a checkpoint file next to the
+    store. If the walk fails, the next one skips the checkpointed months and carries
+    on from the first missing one; save() folds them into the store.
+
+    truncated_at is the last month ('MM/YYYY') of the PDF coverage a walk stopped at,
+    when the stored rows end there: a walk that needs older months than that (no PDF
+    stop, or a PDF ending earlier) cannot stop at the stored ones.
+    """
+
+    def __init__(self, path, rows=None, partial=None, truncated_at=None, checkpoint_only=False):
+        self.path = path
+        self.rows = rows or [] # [(date, number)], newest first
+        self.partial = partial or [] # Rows checkpointed by a walk that has not finished, in scrape order
+        self.partial_dates = {date for date, _ in self.partial}
+        self.truncated_at = truncated_at
+        self.walk_stop = None # How the current walk stopped going back: 'known', 'pdf' or None
+        self.walk_coverage = None # With walk_stop 'pdf', the last month the PDF covered
+        self.checkpoint_only = checkpoint_only
+
+    @classmethod
+    def open(cls, store_dir, cpf, matricula, checkpoint_only=False):
+        """Opens the store of a CPF and matrícula.
+
+        checkpoint_only ([RHNet] incremental_history = 0) neither reads nor writes the
+        stored months; only the checkpoint of an interrupted walk is used.
+        """
+        key = hashlib.sha256(f"{cpf}|{matricula}".encode('utf-8')).hexdigest()
+        path = os.path.join(store_dir, f"{key}.json")
+        store = cls(path, checkpoint_only=checkpoint_only)
+        if not checkpoint_only:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if entry.get('format') == RHNET_HISTORY_FORMAT:
+                    store.rows = [tuple(row) for row in entry['rows']]
+                    store.truncated_at = entry.get('truncated_at')
+            except FileNotFoundError:
+                pass
+        try:
+            with open(store.checkpoint_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        date, number = json.loads(line)
+                    except ValueError:
+                        break # Last line cut short by the failure
+                    store.partial.append((date, number))
+                    store.partial_dates.add(date)
+        except FileNotFoundError:
+            pass
+        return store
+
+    @property
+    def checkpoint_path(self):
+        return os.path.splitext(self.path)[0] + '.partial'
+
+    def dates(self):
+        return {date for date, _ in self.rows}
+
+    def checkpoint(self, date, number):
+        """Appends one scraped row to the checkpoint file."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps([date, number]) + '\n')
+        self.partial.append((date, number))
+        self.partial_dates.add(date)
+
+    def merge(self, scraped_data):
+        """Returns scraped_data plus the checkpointed and stored rows of the months it does not have, newest first.
+
+        A resumed walk scrapes the months before and after the checkpointed ones, so the
+        rows are sorted by competência; rows with another date format keep their place
+        after the dated ones.
+        """
+        seen_dates = set(scraped_data['Date'])
+        rows = list(zip(scraped_data['Date'], scraped_data['Number']))
+        for date, number in itertools.chain(self.partial, self.rows):
+            if date not in seen_dates:
+                seen_dates.add(date)
+                rows.append((date, number))
+        rows.sort(key=lambda row: parse_competencia(row[0]) or (0, 0), reverse=True)
+        return {'Number': [number for _, number in rows], 'Date': [date for date, _ in rows]}
+
+    def save(self, data):
+        """Stores the rows of a finished walk (unless checkpoint_only), replacing the checkpoint."""
+        if not self.checkpoint_only:
+            self.rows = list(zip(data['Date'], data['Number']))
+            if self.walk_stop == 'pdf':
+                # The older stored rows may reach further back than this walk did
+                self.truncated_at = min(filter(None, (self.truncated_at, self.walk_coverage)), key=parse_competencia)
+            elif self.walk_stop is None:
+                self.truncated_at = None # Walked to the start of the history
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = unique_temp_path(self.path)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': RHNET_HISTORY_FORMAT, 'rows': self.rows, 'truncated_at': self.truncated_at}, f)
+            os.replace(temp_path, self.path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.partial = []
+        self.partial_dates = set()
+
+    @staticmethod
+    def clear(store_dir):
+        """Deletes every stored history and checkpoint and returns how many histories were removed."""
+        if not os.path.isdir(store_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(store_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(store_dir, name))
+                removed += 1
+            elif name.endswith('.partial'):
+                os.remove(os.path.join(store_dir, name))
+        return removed
+
+# --- RHNet over HTTP ---
+
+# lxml does not insert the <tbody> browsers add, so table rows are matched with '//'
+RHNET_VINCULO_SELECT_XPATH = '/html/body/form/center[1]/table/tbody/tr[3]/td[2]/select'
+RHNET_MATRICULA_SELECT_XPATH = '/html/body/form/center[1]/table/tbody/tr[4]/td[2]/select'
+RHNET_CONSULTAR_XPATH = '/html/body/form/center[2]/input[1]'
+RHNET_DETALHAR_XPATH = '/html/body/form/center[3]/input[2]'
+RHNET_RECUAR_XPATH = '/html/body/form/center[3]/input[1]'
+RHNET_DATE_XPATH = '/html/body/form/center[1]/table//tr[1]/td[4]'
+RHNET_INFO_XPATH = '/html/body/form/center[1]/table//tr[{}]/td[2]'
+RHNET_VENCIMENTO_XPATH = ('//td[contains(translate(text(), "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"), '
+                          '"vencimento efetivo")]/following-sibling::td[1]')
+ONCLICK_FIELD_REGEX = re.compile(r"""(?:\.|\[['"])(\w+)(?:['"]\])?\.value\s*=\s*['"]([^'"]*)['"]""")
+ONCLICK_ACTION_REGEX = re.compile(r"""\.action\s*=\s*['"]([^'"]+)['"]""")
+# Copies the current field values into the DOM attributes, so the HTML holds what the user filled in
+FORM_SNAPSHOT_SCRIPT = """
+var forms = document.forms;
+for (var f = 0; f < forms.length; f++) {
+    for (var i = 0; i < forms[f].elements.length; i++) {
+        var el = forms[f].elements[i];
+        if (el.tagName == 'SELECT') {
+            for (var j = 0; j < el.options.length; j++) {
+                if (el.options[j].selected) el.options[j].setAttribute('selected', 'selected');
+                else el.options[j].removeAttribute('selected');
+            }
+        } else if (el.type == 'checkbox' || el.type == 'radio') {
+            if (el.checked) el.setAttribute('checked', 'checked'); else el.removeAttribute('checked');
+        } else if (el.tagName == 'TEXTAREA') {
+            el.textContent = el.value;
+        } else if (el.tagName == 'INPUT') {
+            el.setAttribute('value', el.value);
+        }
+    }
+}
+return [document.documentElement.outerHTML, document.URL];
+"""
+
+class RhnetHttpClient:
+    """Submits the RHNet Ficha Financeira forms over a pooled HTTP session and parses pages with lxml.
+
+    Forms are posted as the browser would: the successful fields, the clicked button's
+    name/value and the field assignments of its onclick handler. The client only needs
+    cookies and a start page, so it also works against a local server replaying saved pages.
+    """
+
+    def __init__(self, session=None, timeout=SELENIUM_TIMEOUT):
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    @classmethod
+    def from_driver(cls, driver, timeout=SELENIUM_TIMEOUT):
+        """Creates a client sharing the cookies and user agent of a logged-in WebDriver."""
+        client = cls(timeout=timeout)
+        client.session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent;")
+        for cookie in driver.get_cookies():
+            client.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        return client
+
+    @staticmethod
+    def parse(content, url):
+        return lxml.html.fromstring(content, base_url=url)
+
+    def snapshot(self, driver):
+        """Returns the page of the WebDriver's current frame, with the values filled in so far."""
+        page_html, url = driver.execute_script(FORM_SNAPSHOT_SCRIPT)
+        return self.parse(page_html, url)
+
+    def submit(self, page, button_xpath, check_all=False):
+        """Clicks the button at button_xpath of the page's first form and returns the resulting page.
+
+        check_all ticks every checkbox first, like the page's 'marca_desmarca' box.
+        """
+        buttons = page.xpath(button_xpath)
+        if not buttons:
+            raise ValueError(f"botão '{button_xpath}' não encontrado")
+        button = buttons[0]
+        form = page.forms[0]
+        if check_all:
+            for checkbox in form.xpath('.//input[@type="checkbox"]'):
+                checkbox.checked = True
+
+        # Plain buttons are never sent by a browser; repeated names (e.g. one checkbox per record) are kept
+        button_names = {el.get('name') for el in form.iter('input', 'button')
+                        if el.tag == 'button' or (el.get('type') or '').lower() == 'button'}
+        fields = [(name, value) for name, value in form.form_values() if name not in button_names]
+        if button.get('name') and (button.get('type') or 'submit').lower() == 'submit':
+            fields.append((button.get('name'), button.get('value', '')))
+        action = form.action or page.base_url
+        onclick = button.get('onclick') or ''
+        for name, value in ONCLICK_FIELD_REGEX.findall(onclick):
+            fields = [field for field in fields if field[0] != name] + [(name, value)]
+        action_match = ONCLICK_ACTION_REGEX.search(onclick)
+        if action_match:
+            action = requests.compat.urljoin(page.base_url, action_match.group(1))
+
+        headers = {'Referer': page.base_url}
+        if form.method.upper() == 'POST':
+            response = self.session.post(action, data=fields, headers=headers, timeout=self.timeout)
+        else:
+            response = self.session.get(action, params=fields, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return self.parse(response.content, response.url)
+
+HISTORY_PAGE_SCRIPT = """
+var find = function (xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+};
+var text = function (node) { return node ? node.textContent.trim() : null; };
+var recuar = find(arguments[2]);
+return {date: text(find(arguments[0])), vencimento: text(find(arguments[1])),
+        recuar: recuar ? !recuar.disabled : null};
+"""
+
+CLICK_XPATH_SCRIPT = """
+document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue.click();
+"""
+
+def history_page_loaded(previous_date):
+    """Wait condition: the current history page, read by HISTORY_PAGE_SCRIPT, once its date is not previous_date.
+
+    Returns {'date', 'vencimento', 'recuar'} (recuar: None when the button is missing).
+    """
+    def condition(driver):
+        try:
+            page = driver.execute_script(HISTORY_PAGE_SCRIPT, RHNET_DATE_XPATH, RHNET_VENCIMENTO_XPATH, RHNET_RECUAR_XPATH)
+        except (JavascriptException, StaleElementReferenceException):
+            return False # Page being replaced
+        return page if page and page['date'] and page['date'] != previous_date else False
+    return condition
+
+def read_history_page(page):
+    """Returns (date text or None, VENCIMENTO EFETIVO text or None, Recuar enabled) of an RHNet history page."""
+    date_cells = page.xpath(RHNET_DATE_XPATH)
+    date_text = date_cells[0].text_content().strip() if date_cells else None
+    vencimento_cells = page.xpath(RHNET_VENCIMENTO_XPATH)
+    number_text_raw = vencimento_cells[0].text_content().strip() if vencimento_cells else None
+    recuar_buttons = page.xpath(RHNET_RECUAR_XPATH)
+    recuar_enabled = bool(recuar_buttons) and recuar_buttons[0].get('disabled') is None
+    return date_text, number_text_raw, recuar_enabled
+
+# --- Consolidation ---
+
+class ChPivot:
+    """Consolidates (date, CH) records into the year x month table of the report as they arrive.
+
+    Dates are 'MM/YYYY'. A later record for the same month replaces the earlier one,
+    with a warning when the values differ. Records added with a label (the matrícula,
+    when several are scraped) get rows of their own, e.g. '2015 (Mat. 123)'.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.rows = {} # year -> {month column: number}
+
+    def add(self, date, number, label=None):
+        month_num = date[:2].strip()
+        year = date[3:].strip()
+        if label is not None:
+            year = f"{year} ({label})"
+        row = self.rows.setdefault(year, {})
+        month_name = MONTH_NAMES_MAP_REVERSE.get(month_num)
+        if month_name is None:
+            self.log("WARNING", f"Número de mês inválido '{month_num}' encontrado para o ano {year}.")
+            return
+        current_val = row.get(month_name, '')
+        if current_val != '' and current_val != str(number):
+            self.log("WARNING", f"Múltiplos valores para {month_name}/{year}. Usando último: {number} (anterior: {current_val})")
+        row[month_name] = number
+
+    def add_records(self, data, label=None):
+        """Adds a {'Number': [...], 'Date': [...]} dict of records."""
+        for date, number in zip(data['Date'], data['Number']):
+            self.add(date, number, label)
+
+    def to_frame(self):
+        """Returns the pivot as a DataFrame indexed by year, with one column per month."""
+        # Get unique years sorted numerically if possible
+        try:
+            unique_years_str = sorted(self.rows, key=lambda row_key: (int(row_key.split()[0]), row_key))
+        except (ValueError, IndexError):
+            unique_years_str = sorted(self.rows)
+            self.log("WARNING", f"Anos não numéricos encontrados: {unique_years_str}. Ordenando como texto.")
+
+        # Use the correct month names for columns from the constant map
+        month_columns = list(MONTH_NAMES_MAP_REVERSE.values()) # JAN, FEV, etc.
+        pivot_table = pd.DataFrame('', index=unique_years_str, columns=month_columns)
+        for year, row in self.rows.items():
+            if year not in pivot_table.index:
+                self.log("WARNING", f"Ano '{year}' encontrado nos dados mas não nos anos únicos calculados.")
+                continue
+            for month_name, number in row.items():
+                pivot_table.at[year, month_name] = number
+        return pivot_table
+
+class PdfCoverage:
+    """Last competência yielded by the PDF stage, published to the concurrent RHNet stage.
+
+    last_month is a (year, month) tuple, or None when the PDF yielded nothing. done is
+    cleared by reset() when a PDF stage starts and set again when it ends, successfully
+    or not.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.done.set()
+        self.last_month = None
+
+    def reset(self):
+        self.done.clear()
+        self.last_month = None
+
+    def add(self, date):
+        month = parse_competencia(date)
+        if month is not None and (self.last_month is None or month > self.last_month):
+            self.last_month = month
+
+    def finish(self):
+        self.done.set()
+
+def parse_competencia(date_text):
+    """Returns 'MM/YYYY' as a (year, month) tuple, or None when it is not in that format."""
+    match = re.fullmatch(r"\s*(\d{2})/(\d{4})\s*", date_text or '')
+    if match is None:
+        return None
+    return int(match.group(2)), int(match.group(1))
+
+# --- Report ---
+
+def write_html_report(html_file_path, pivot_table, server_info):
+    """Writes the CH table and the servidor's Nome/Cargo/Referência as an HTML page."""
+    title = "CÁLCULO DA MÉDIA DE CARGA HORÁRIA ANUAL"
+    nome_safe = html.escape(server_info.get('nome', 'N/A'))
+    cargo_safe = html.escape(server_info.get('cargo', 'N/A'))
+    ref_safe = html.escape(server_info.get('referencia', 'N/A'))
+    title2 = f"NOME: {nome_safe}<br>CARGO: {cargo_safe}<br>REFERENCIA: {ref_safe}"
+
+    with open(html_file_path, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n')
+        f.write('<meta charset="UTF-8">\n')
+        f.write('<meta name="viewport" content="width=device-width, initial-scale=1.0">\n')
+        f.write('<title>Cálculo CH</title>\n')
+        f.write('<style>\n')
+        f.write('  body { font-family: sans-serif; margin: 20px; }\n')
+        f.write('  h1 { text-align: center; color: #333; }\n')
+        f.write('  h3 { color: #555; border-bottom: 1px solid #ccc; padding-bottom: 10px; margin-bottom: 20px; }\n')
+        f.write('  table { border-collapse: collapse; width: 100%; font-size: 12px; text-align: center; margin-top: 15px; }\n')
+        f.write('  th, td { border: 1px solid #ccc; padding: 6px 8px; }\n')
+        f.write('  th { background-color: #f2f2f2; font-weight: bold; }\n')
+        f.write('  td.year-header { font-weight: bold; background-color: #f8f8f8; text-align: center; }\n')
+        f.write('  tr:nth-child(even) { background-color: #fafafa; }\n')
+        f.write('</style>\n</head>\n<body>\n')
+
+        f.write(f'<h1>{title}</h1>\n')
+        f.write(f'<h3>{title2}</h3>\n')
+
+        f.write('<table>\n')
+        f.write('<thead>\n<tr><th>Ano</th>')
+        for month in pivot_table.columns:
+            f.write(f'<th>{month}</th>')
+        f.write('</tr>\n</thead>\n')
+
+        f.write('<tbody>\n')
+        for year in pivot_table.index:
+            f.write(f'<tr><td class="year-header">{html.escape(str(year))}</td>')
+            for month in pivot_table.columns:
+                value_str = str(pivot_table.loc[year, month]).strip()
+                value_display = ""
+                if value_str:
+                    try:
+                        value_float = float(value_str)
+                        value_display = str(int(value_float))
+                    except ValueError:
+                        if value_str.isdigit():
+                            value_display = value_str
+                        else:
+                            value_display = value_str if value_str == "-" else "" 
+
+                value_safe = html.escape(value_display)
+                f.write(f'<td>{value_safe}</td>')
+            f.write('</tr>\n')
+        f.write('</tbody>\n')
+
+        f.write('</table>\n')
+        f.write('</body>\n</html>\n')
+
+
 # --- Main Application Class ---
 
 class CalculadoraCHApp:
     def __init__(self, root):
+        """Sets up the worker state and, when root is a Tk window, the GUI (root None: headless)."""
         self.root = root
+
+        # Queue for communication between worker thread and GUI
+        self.log_queue = queue.Queue()
+        self.result_queue = queue.Queue()
+
+        # Flag to signal cancellation to the worker thread
+        self.cancel_requested = threading.Event()
+        # Set when one of the concurrent stages (PDF / RHNet) fails, to stop the other
+        self.stage_failed = threading.Event()
+        # Months the PDF stage covers, so RHNet stops going back once it reaches them
+        self.pdf_coverage = PdfCoverage()
+        # Stop reasons check_cancel already logged in this run, so polling loops log them once
+        self.logged_stops = set()
+        self.logged_stops_lock = threading.Lock()
+        # Set by run_rhnet_stage while a transient RHNet failure would be retried
+        self.rhnet_retry_allowed = False
+        self.rhnet_retry_requested = False
+        # Set once the login and search form worked and a history walk began
+        self.rhnet_walk_started = False
+        # Set when RHNet failed before any walk began (login or search form)
+        self.rhnet_failed_before_walk = False
+        if root is None:
+            return
+
         self.root.title("Calculadora CH")
         # self.root.geometry("650x550") # Optional: set initial size
 
         # Center the window
         self.center_window(700, 550)
 
-        try:
-            locale.setlocale(locale.LC_NUMERIC, 'pt_BR.UTF-8')
-            locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
-        except locale.Error as e:
-            try:
-                locale.setlocale(locale.LC_NUMERIC, 'Portuguese_Brazil.1252')
-                locale.setlocale(locale.LC_TIME, 'Portuguese_Brazil.1252')
-            except locale.Error as e2:
-                 locale.setlocale(locale.LC_ALL, '')
-                 self.log_message("WARNING", f"Falha ao definir localidade pt_BR: {e} / {e2}. Usando padrão do sistema.")
+        locale_warning = set_pt_br_locale()
 
         # Variables to store user input
         self.login_var = tk.StringVar()
@@ -173,13 +1745,8 @@ class CalculadoraCHApp:
         self.cpf_var = tk.StringVar()
         self.pdf_path_var = tk.StringVar(value="Nenhum arquivo selecionado")
         self.show_password_var = tk.BooleanVar(value=False)
-
-        # Queue for communication between worker thread and GUI
-        self.log_queue = queue.Queue()
-        self.result_queue = queue.Queue()
-
-        # Flag to signal cancellation to the worker thread
-        self.cancel_requested = threading.Event()
+        if locale_warning:
+            self.log_message("WARNING", locale_warning)
 
         # Setup GUI elements
         self.create_widgets()
@@ -356,11 +1923,23 @@ class CalculadoraCHApp:
                 self.log_message("INFO", "Botão Cancelar clicado, mas nenhum processo ativo.")
 
     def check_cancel(self):
-        """Utility for worker thread to check if cancellation was requested."""
+        """Utility for worker thread to check if cancellation was requested.
+
+        Both stages poll it in tight loops, so each reason is logged only the first time
+        it is detected in a run.
+        """
         if self.cancel_requested.is_set():
-             self.log_message("INFO", "Processo de cálculo cancelado.")
-             return True
-        return False
+            stop = ("INFO", "Processo de cálculo cancelado.")
+        elif self.stage_failed.is_set():
+            stop = ("DEBUG", "Etapa interrompida: a outra etapa do cálculo falhou.")
+        else:
+            return False
+        with self.logged_stops_lock:
+            first_time = stop not in self.logged_stops
+            self.logged_stops.add(stop)
+        if first_time:
+            self.log_message(*stop)
+        return True
 
     def start_calculation(self):
         """Validates inputs and starts the calculation in a separate thread."""
@@ -455,21 +2034,43 @@ class CalculadoraCHApp:
         """The function that runs in the worker thread."""
         driver = None
         operation_status = "UNKNOWN"
+        rhnet_future = None
+        self.stage_failed.clear()
+        self.logged_stops.clear()
+        self.pdf_coverage.reset()
         try:
-            # --- 1. Parse PDF ---
             if self.check_cancel(): operation_status = "CANCELLED"; return
+            start_time = time.perf_counter()
+
+            # --- 1. Scrape RHNet in the background while the PDF is parsed ---
+            self.log_message("INFO", "Acessando RHNet e buscando dados...")
+            rhnet_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            rhnet_future = rhnet_executor.submit(self.run_rhnet_stage, username, password, cpf)
+            rhnet_executor.shutdown(wait=False)
+
+            # --- 2. Parse PDF, consolidating each record as it is read ---
             self.log_message("INFO", "Analisando PDF...")
-            data1 = self.parse_pdf(pdf_file_path)
+            pivot = ChPivot(self.log_message)
+            def add_pdf_record(date, number):
+                pivot.add(date, number)
+                self.pdf_coverage.add(date)
+            try:
+                pdf_completed = consume_stream(self.iter_pdf_ch(pdf_file_path), add_pdf_record)
+            finally:
+                self.pdf_coverage.finish()
+            pdf_seconds = time.perf_counter() - start_time
+            if pdf_completed is None:
+                self.stage_failed.set()
+            else:
+                self.log_message("INFO", f"Análise do PDF: {pdf_seconds:.1f}s. Aguardando RHNet...")
+
+            # --- Join the RHNet stage ---
+            driver, scraped_data, rhnet_seconds = rhnet_future.result()
+            self.log_message("INFO", f"Etapas concluídas: PDF {pdf_seconds:.1f}s, RHNet {rhnet_seconds:.1f}s, total {time.perf_counter() - start_time:.1f}s.")
             if self.cancel_requested.is_set(): operation_status = "CANCELLED"; return
-            if data1 is None:
+            if pdf_completed is None:
                 operation_status = "ERROR"
                 return
-
-            # --- 2. Scrape RHNet ---
-            if self.check_cancel(): operation_status = "CANCELLED"; return
-            self.log_message("INFO", "Acessando RHNet e buscando dados...")
-            driver, scraped_data = self.scrape_rhnet(username, password, cpf)
-            if self.cancel_requested.is_set(): operation_status = "CANCELLED"; return
             if scraped_data is None:
                 driver = None
                 operation_status = "ERROR/CANCELLED by scrape_rhnet"
@@ -480,49 +2081,17 @@ class CalculadoraCHApp:
 
             # --- 3. Consolidate Data ---
             if self.check_cancel(): operation_status = "CANCELLED"; return
-            df1 = pd.DataFrame(data1)
-            df2 = pd.DataFrame(data2)
-            df = pd.concat([df1, df2]).reset_index(drop=True)
-
-            # Extract months and years from the dates
             try:
-                df['Month'] = df['Date'].str[:2].str.strip()
-                df['Year'] = df['Date'].str[3:].str.strip()
-            except AttributeError as e:
+                if 'matriculas' in scraped_data:
+                    for matricula, matricula_data in scraped_data['matriculas']:
+                        pivot.add_records(matricula_data, label=f"Mat. {matricula}")
+                else:
+                    pivot.add_records(data2)
+            except (AttributeError, TypeError) as e:
                  self.log_message("ERROR", f"Erro ao extrair Mês/Ano da coluna 'Date'. Verifique os dados. {e}")
                  self.result_queue.put(Exception(f"Formato de data inválido: {e}"))
                  return
-
-            # Get unique years sorted numerically if possible
-            try:
-                unique_years = sorted(df['Year'].astype(int).unique())
-                unique_years_str = [str(y) for y in unique_years]
-            except ValueError:
-                 unique_years_str = sorted(df['Year'].unique())
-                 self.log_message("WARNING", f"Anos não numéricos encontrados: {unique_years_str}. Ordenando como texto.")
-
-            # Use the correct month names for columns from the constant map
-            month_columns = list(MONTH_NAMES_MAP_REVERSE.values()) # JAN, FEV, etc.
-
-            # Create an empty pivot table DataFrame
-            pivot_table = pd.DataFrame('', index=unique_years_str, columns=month_columns)
-
-            # Fill the pivot table
-            for index, row in df.iterrows():
-                 year = row['Year']
-                 month_num = row['Month']
-                 number = row['Number']
-                 if year in pivot_table.index:
-                     month_name = MONTH_NAMES_MAP_REVERSE.get(month_num)
-                     if month_name in pivot_table.columns:
-                        current_val = pivot_table.at[year, month_name]
-                        if current_val != '' and current_val != str(number):
-                             self.log_message("WARNING", f"Múltiplos valores para {month_name}/{year}. Usando último: {number} (anterior: {current_val})")
-                        pivot_table.at[year, month_name] = number
-                     else:
-                         self.log_message("WARNING", f"Número de mês inválido '{month_num}' encontrado para o ano {year}.")
-                 else:
-                      self.log_message("WARNING", f"Ano '{year}' encontrado nos dados mas não nos anos únicos calculados.")
+            pivot_table = pivot.to_frame()
 
             if self.check_cancel(): operation_status = "CANCELLED"; return
 
@@ -536,13 +2105,21 @@ class CalculadoraCHApp:
             self.result_queue.put(e)
             operation_status = "ERROR"
         finally:
+            # Never leave the RHNet stage running on its own
+            if rhnet_future is not None:
+                if not rhnet_future.done():
+                    self.stage_failed.set()
+                driver = driver or rhnet_future.result()[0]
+
             if operation_status == "CANCELLED":
                 self.log_message("INFO", "Confirmação de cancelamento na thread.")
                 if self.result_queue.empty():
                     self.result_queue.put("CANCELLED")
 
-            # Attempt to close the driver if it exists and wasn't closed already
-            if driver:
+            # Keep the logged-in browser for the next run, or close it
+            if driver and BROWSER_POOL.release(username, driver):
+                self.log_message("DEBUG", "Navegador mantido aberto e autenticado para o próximo cálculo.")
+            elif driver:
                 try:
                     driver.quit()
                     driver = None
@@ -551,188 +2128,126 @@ class CalculadoraCHApp:
             else:
                 self.log_message("DEBUG", "Nenhuma instância de navegador para fechar.")
 
+    def run_rhnet_stage(self, username, password, cpf):
+        """Runs scrape_rhnet as the concurrent stage of run_calculation_thread.
+
+        A scrape that fails on a browser crash or timeout during the history walk is
+        retried up to [RHNet] retries times, waiting RHNET_RETRY_DELAY seconds (doubled on
+        each retry); the new session resumes from the months checkpointed so far. Before
+        the walk began only connection errors are retried, so a wrong password is not
+        sent again. Returns (driver, scraped_data, seconds).
+        If the scrape does not finish, the run is flagged through stage_failed so the PDF
+        stage stops too.
+        """
+        start_time = time.perf_counter()
+        retries = max(0, read_config_int('RHNet', 'retries', DEFAULT_RHNET_RETRIES))
+        self.rhnet_walk_started = False
+        self.rhnet_failed_before_walk = False
+        for attempt in range(1, retries + 2):
+            self.rhnet_retry_allowed = attempt <= retries
+            self.rhnet_retry_requested = False
+            try:
+                driver, scraped_data = self.scrape_rhnet(username, password, cpf)
+            except Exception as e:
+                self.log_message("ERROR", f"Erro inesperado na etapa do RHNet: {e}")
+                self.result_queue.put(e)
+                driver, scraped_data = None, None
+            if scraped_data is not None or not self.rhnet_retry_requested or self.check_cancel():
+                break
+            delay = RHNET_RETRY_DELAY * 2 ** (attempt - 1)
+            self.log_message("WARNING", f"Extração do RHNet falhou (tentativa {attempt} de {retries + 1}). Nova tentativa em {delay}s, a partir do último mês salvo.")
+            retry_at = time.perf_counter() + delay
+            while time.perf_counter() < retry_at and not self.stage_failed.is_set():
+                if self.cancel_requested.wait(0.2):
+                    break
+            if self.check_cancel(): # Not even a browser for a run cancelled or failed meanwhile
+                break
+        self.rhnet_retry_allowed = False
+        if scraped_data is None:
+            self.stage_failed.set()
+        return driver, scraped_data, time.perf_counter() - start_time
+
     def parse_pdf(self, pdf_file_path):
-        """Parses the PDF file to extract ch_number and dates. (Adapted from legacy)"""
+        """Parses the whole PDF into {'Number': [...], 'Date': [...]}. Returns None on error or cancellation."""
         numbers1 = []
         dates1 = []
 
+        def collect(date, number):
+            dates1.append(date)
+            numbers1.append(number)
+
+        if consume_stream(self.iter_pdf_ch(pdf_file_path), collect) is None:
+            return None
+        return {'Number': numbers1, 'Date': dates1}
+
+    def iter_pdf_ch(self, pdf_file_path):
+        """Parses the PDF page by page, yielding (date, ch_number) as each page is resolved. (Adapted from legacy)
+
+        Each page is extracted, resolved and released before the next one is read, so
+        memory does not grow with the document. The generator returns True once the PDF
+        was read to the end (or to the Mar/2014 stop) and None on error or cancellation.
+        """
+        pdf_workers = read_config_int('Performance', 'pdf_workers', DEFAULT_PDF_WORKERS)
+        extraction_mode = read_config_option('Performance', 'pdf_extraction_mode', DEFAULT_PDF_EXTRACTION_MODE).strip().lower()
+        if extraction_mode not in PDF_EXTRACTION_MODES:
+            self.log_message("WARNING", f"Modo de extração de PDF inválido '{extraction_mode}'. Usando '{DEFAULT_PDF_EXTRACTION_MODE}'.")
+            extraction_mode = DEFAULT_PDF_EXTRACTION_MODE
+        prescan_mode = read_config_option('Performance', 'pdf_prescan', DEFAULT_PDF_PRESCAN_MODE).strip().lower()
+        if prescan_mode not in PDF_PRESCAN_MODES:
+            self.log_message("WARNING", f"Modo de pré-varredura do PDF inválido '{prescan_mode}'. Usando '{DEFAULT_PDF_PRESCAN_MODE}'.")
+            prescan_mode = DEFAULT_PDF_PRESCAN_MODE
+
+        pdf_cache = ParsedPdfCache(get_pdf_cache_dir()) if read_config_int('Performance', 'pdf_result_cache', 1) else None
+        pdf_hash = table_version = cached_entry = None
+        if pdf_cache is not None:
+            try:
+                pdf_hash = get_file_signature(pdf_file_path)['sha256']
+                table_version = get_file_signature(EXCEL_FILE_PATH)['sha256']
+                cached_entry = pdf_cache.load(pdf_hash, extraction_mode)
+            except Exception as e:
+                self.log_message("WARNING", f"Cache de análise do PDF não utilizado: {e}")
+                pdf_hash = None
+
+        # Page records and results are only kept when they are going to be cached
+        entry_pages = [] if pdf_hash is not None else None
+        entry_result = {'Number': [], 'Date': []} if pdf_hash is not None else None
         try:
-            with fitz.open(pdf_file_path) as pdf_document:
-                if self.check_cancel(): return None
-                self.log_message("INFO", f"PDF contém {pdf_document.page_count} páginas.")
-                for page_num in range(pdf_document.page_count):
+            if cached_entry is not None and cached_entry['table_version'] == table_version:
+                result = cached_entry['result']
+                self.log_message("INFO", f"Análise do PDF carregada do cache ({len(result['Number'])} meses). Leitura das páginas ignorada.")
+                for date, number in zip(result['Date'], result['Number']):
+                    yield date, number
+                return True
+            if cached_entry is not None and not cached_entry['stopped']:
+                self.log_message("INFO", "Páginas do PDF carregadas do cache. Tabela de vencimentos alterada, recalculando CH.")
+                expected_years = {referencia_year for _, referencia_year, _, _, _ in cached_entry['pages']}
+                outcome = yield from self.resolve_page_records(cached_entry['pages'], expected_years, entry_pages, entry_result)
+            else:
+                with fitz.open(pdf_file_path) as pdf_document:
                     if self.check_cancel(): return None
-
-                    page = pdf_document.load_page(page_num)
-                    page_text = page.get_text("text")
-
-                    self.log_message("DEBUG", f"Analisando página {page_num + 1}...")
-
-                    referencia_match = re.search(REFERENCIA_REGEX, page_text)
-                    if referencia_match:
-                        referencia_year = int(referencia_match.group(1))
-                        self.log_message("DEBUG", f"Página {page_num + 1}: Ano de Referência = {referencia_year}")
-                        if referencia_year < 1993:
-                            self.log_message("INFO", f"Página {page_num + 1}: Ano {referencia_year} < 1993. Pulando página.")
-                            continue
+                    page_count = pdf_document.page_count
+                    self.log_message("INFO", f"PDF contém {page_count} páginas.")
+                    prescan = self.prescan_pdf_pages(pdf_document, prescan_mode)
+                    if prescan is None: return None
+                    page_nums, expected_years = prescan
+                    if pdf_workers > 1 and len(page_nums) > PDF_PAGES_PER_TASK:
+                        page_records = self.iter_pdf_pages_parallel(pdf_file_path, page_nums, pdf_workers, extraction_mode)
                     else:
-                        self.log_message("WARNING", f"Referência não encontrada na página {page_num + 1}. Pulando página.")
-                        continue
-
-                    cargo_match = re.search(CARGO_REGEX, page_text, re.IGNORECASE)
-                    if cargo_match:
-                        cargo_text = cargo_match.group(1).upper() + "-" + cargo_match.group(2).upper()
-                        self.log_message("DEBUG", f"Página {page_num + 1}: Cargo = {cargo_text}")
-                    else:
-                        self.log_message("WARNING", f"Cargo não encontrado na página {page_num + 1}. Pulando página.")
-                        continue
-
-                    # Find 'VENCIMENTO' amount associated with VENCIMENTO_CODES
-                    vencimento_value_str = None
-                    vencimento_found = False
-                    for vencimento_code in VENCIMENTO_CODES:
-                        pattern = re.compile(rf"{vencimento_code}\s+.*?\s+(\d{{1,3}}(?:\.\d{{3}})*(?:,\d{{1,2}}))\b", re.IGNORECASE)
-                        match = pattern.search(page_text)
-                        if match:
-                             vencimento_value_str = match.group(1)
-                             vencimento_value_float = locale.atof(vencimento_value_str)
-                             self.log_message("DEBUG", f"Página {page_num + 1}: Código {vencimento_code} encontrado. Vencimento Bruto = {vencimento_value_str} ({vencimento_value_float})")
-                             vencimento_found = True
-                             break
-
-                    if not vencimento_found:
-                         self.log_message("DEBUG", f"Página {page_num + 1}: Nenhum código de vencimento {VENCIMENTO_CODES} encontrado com valor numérico. Pulando linha de vencimento.")
-                         self.log_message("WARNING", f"Nenhum código de vencimento {VENCIMENTO_CODES} encontrado na página {page_num + 1}. Pulando página.")
-                         continue
-
-                    # Find TOTAL PROVENTOS (less critical for CH lookup, but good for context/validation)
-                    proventos_match = re.search(rf"{TOTAL_PROVENTOS_TEXT}\s+(\d{{1,3}}(?:\.\d{{3}})*(?:,\d{{1,2}}))\b", page_text, re.IGNORECASE)
-                    if proventos_match:
-                        total_proventos_str = proventos_match.group(1)
-                        self.log_message("DEBUG", f"Página {page_num + 1}: Total Proventos = {total_proventos_str}")
-                    else:
-                        self.log_message("WARNING", TOTAL_PROVENTOS_NOT_FOUND_MSG.format(page_num + 1))
-
-                    # --- Find corresponding CH in Excel ---
-                    excel_year = MISSING_YEARS.get(referencia_year, referencia_year)
-                    if excel_year != referencia_year:
-                        self.log_message("INFO", f"Dados para {referencia_year} não encontrados no Excel. Usando dados de {excel_year}.")
-
-                    try:
-                        workbook = openpyxl.load_workbook(EXCEL_FILE_PATH, data_only=True)
-                        if self.check_cancel(): return None
-                        if str(excel_year) not in workbook.sheetnames:
-                            self.log_message("ERROR", f"Planilha para o ano {excel_year} não encontrada no arquivo Excel: {EXCEL_FILE_PATH}")
-                            continue
-                        worksheet = workbook[str(excel_year)]
-                        self.log_message("DEBUG", f"Acessando planilha Excel: '{excel_year}'")
-
-                    except FileNotFoundError:
-                        self.log_message("ERROR", f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}")
-                        self.result_queue.put(Exception(f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}"))
-                        return None
-                    except Exception as e:
-                        self.log_message("ERROR", ERROR_OPENING_EXCEL_FILE_MSG.format(excel_year, e))
-                        self.result_queue.put(Exception(ERROR_OPENING_EXCEL_FILE_MSG.format(excel_year, e)))
-                        return None
-
-                    # Find the relevant month on the PDF page
-                    vencimento_associated = []
-                    proventos_index = page_text.find(TOTAL_PROVENTOS_TEXT)
-                    if proventos_index != -1:      
-                        proventos_text_block = page_text[proventos_index + len(TOTAL_PROVENTOS_TEXT):]
-                        number_pattern = r'\b\d{1,3}(?:\.\d{3})*(?:,\d{1,2})\b'
-                        proventos_numbers_found = re.findall(number_pattern, proventos_text_block)
-                        proventos_numbers_on_line = proventos_numbers_found[:12]
-
-                        # Find the VENCIMENTO numbers
-                        vencimento_numbers_1101_line = []
-                        vencimento_code = VENCIMENTO_CODES[0]
-                        vencimento_index = page_text.find(vencimento_code)
-                        if vencimento_index != -1:
-                            vencimento_text_block = page_text[vencimento_index + len(vencimento_code):]
-                            vencimento_numbers_found = re.findall(number_pattern, vencimento_text_block)
-                            vencimento_numbers_1101_line = vencimento_numbers_found
-                        else:
-                            self.log_message("DEBUG", f"Código VENCIMENTO {vencimento_code} não encontrado na página {page_num + 1}.")
-
-                        proventos_numbers_on_line.extend(['0,00'] * (12 - len(proventos_numbers_on_line)))
-                        proventos_numbers_on_line = proventos_numbers_on_line[:12]
-
-                        venc_assoc_index = 0
-                        for provento_str in proventos_numbers_on_line:
-                            try:
-                                provento_val = locale.atof(provento_str.strip()) if provento_str else 0.0
-                            except ValueError:
-                                provento_val = 0.0
-
-                            if provento_val == 0.0:
-                                vencimento_associated.append("0")
-                            else:
-                                if venc_assoc_index < len(vencimento_numbers_1101_line):
-                                    venc_num_str = vencimento_numbers_1101_line[venc_assoc_index].strip()
-                                    try:
-                                        venc_float = locale.atof(venc_num_str)
-                                        vencimento_associated.append(f"{venc_float:.2f}")
-                                    except ValueError:
-                                        self.log_message("WARNING", f"Página {page_num + 1}: Não foi possível converter valor de vencimento '{venc_num_str}' para número.")
-                                        vencimento_associated.append("0")
-                                    venc_assoc_index += 1
-                                else:
-                                    self.log_message("WARNING", f"Página {page_num + 1}: Mais valores não-zero em PROVENTOS do que em VENCIMENTO ({vencimento_code}). Faltando dados?")
-                                    vencimento_associated.append("0")
-
-                        # Ensure vencimento_associated has 12 entries, padding with "0" if needed
-                        while len(vencimento_associated) < 12:
-                            vencimento_associated.append("0")
-                        vencimento_associated = vencimento_associated[:12]
-                        self.log_message("DEBUG", f"Página {page_num + 1}: Vencimento Associado (por mês, baseado em proventos!=0): {vencimento_associated}")
-
-                    else:
-                        self.log_message("WARNING", TOTAL_PROVENTOS_NOT_FOUND_MSG.format(page_num + 1))
-                        continue
-    
-                    # --- Loop through months based on legacy logic ---
-                    exit_loop_condition_met = False
-                    for month_idx, current_month_abbr in enumerate(MONTHS):
-                        if self.check_cancel(): return None
-
-                        vencimento_str_for_month = vencimento_associated[month_idx]
-                        vencimento_float_for_month = float(vencimento_str_for_month)
-
-                        if vencimento_float_for_month != 0.0:
-                            self.log_message("DEBUG", f"Processando Mês: {current_month_abbr} (Venc. Associado: {vencimento_float_for_month})")
-
-                            # Determine the month to use for Excel lookup (Dec for missing years)
-                            lookup_month_excel = MONTHS[-1] if referencia_year in MISSING_YEARS else current_month_abbr
-                            self.log_message("DEBUG", f"Mês para busca no Excel: {lookup_month_excel} (Cargo: {cargo_text}, Vencimento Base: {vencimento_float_for_month})")
-
-                            # Find the CH Number in the Excel sheet for this specific month's value
-                            ch_number = self.find_ch_in_excel(worksheet, lookup_month_excel, cargo_text, vencimento_float_for_month)
-
-                            if ch_number is not None:
-                                self.log_message("INFO", f"Página {page_num + 1} ({current_month_abbr}/{referencia_year}): CH encontrado = {ch_number}")
-                                numbers1.append(str(ch_number))
-                                month_number = MONTH_NUMBERS_MAP[current_month_abbr]
-                                dates1.append(f"{month_number}/{referencia_year}")
-
-                                # Check for the specific exit condition from legacy code
-                                if referencia_year == 2014 and current_month_abbr == 'Mar':
-                                    self.log_message("INFO", "Condição de parada (Mar/2014) atingida na análise do PDF.")
-                                    exit_loop_condition_met = True
-                                    break
-                            else:
-                                pass
-                        else:
-                            pass
-
-                    if exit_loop_condition_met:
-                        break
+                        page_records = (extract_pdf_page(pdf_document.load_page(page_num), page_num, self.log_message, extraction_mode)
+                                        for page_num in page_nums)
+                    outcome = yield from self.resolve_page_records(page_records, expected_years, entry_pages, entry_result)
+            if outcome is None: return None
 
             self.log_message("INFO", "Análise do PDF concluída.")
-            return {'Number': numbers1, 'Date': dates1}
+            # Only a parse that reached its end is cached; an interrupted one would be served as complete
+            if pdf_hash is not None and outcome in ('stopped', 'done') and not self.cancel_requested.is_set() and not self.stage_failed.is_set():
+                try:
+                    pdf_cache.save(pdf_hash, extraction_mode, table_version, entry_pages, entry_result, outcome == 'stopped')
+                except Exception as e:
+                    self.log_message("WARNING", f"Não foi possível salvar o cache da análise do PDF: {e}")
+            return True
 
-        except fitz.fitz.FileNotFoundError:
+        except (FileNotFoundError, fitz.FileNotFoundError):
             self.log_message("ERROR", f"Arquivo PDF não encontrado: {pdf_file_path}")
             self.result_queue.put(Exception(f"Arquivo PDF não encontrado: {pdf_file_path}"))
             return None
@@ -743,509 +2258,940 @@ class CalculadoraCHApp:
             self.result_queue.put(Exception(f"Erro ao processar PDF: {e}"))
             return None
 
-    def find_ch_in_excel(self, worksheet, lookup_month, target_cargo, target_vencimento):
-        """Finds the CH number in the Excel sheet matching month, cargo, and closest value."""
-        self.log_message("DEBUG", f"Buscando no Excel: Mês='{lookup_month}', Cargo='{target_cargo}', Vencimento Base={target_vencimento}")
-        DIFFERENCE_THRESHOLD = 5.0
-        month_col_index = -1
-        cargo_col_index = -1
-        ch_col_index = 3
-        header_row = 1
-        cargo_label_row = 2
-        for col_idx in range(1, worksheet.max_column + 1):
-            month_cell_value = worksheet.cell(row=header_row, column=col_idx).value
-            cargo_cell_value = worksheet.cell(row=cargo_label_row, column=col_idx).value
-
-            if isinstance(month_cell_value, str) and month_cell_value.strip().upper() == lookup_month.upper():
-                month_col_index = col_idx
-                if isinstance(cargo_cell_value, str) and cargo_cell_value.strip().upper() == 'CARGO':
-                     cargo_col_index = col_idx
-                     break
-
-        if month_col_index == -1 or cargo_col_index == -1:
-             month_row_idx = None
-             cargo_label_row_idx = None
-             target_cargo_row_idx = None
-
-             for row_idx in range(1, worksheet.max_row + 1):
-                 cell_b_val = worksheet.cell(row=row_idx, column=2).value
-                 if isinstance(cell_b_val, str):
-                    if month_row_idx is None and cell_b_val.strip().upper() == lookup_month.upper():
-                        month_row_idx = row_idx
-                        self.log_message("DEBUG", f"Mês '{lookup_month}' encontrado na linha {row_idx}, Col B.")
-                        for cargo_search_row in range(month_row_idx + 1, worksheet.max_row + 1):
-                            sub_cell_b_val = worksheet.cell(row=cargo_search_row, column=2).value
-                            if isinstance(sub_cell_b_val, str):
-                                 if sub_cell_b_val.strip().upper() in [m.upper() for m in MONTHS]:
-                                      self.log_message("DEBUG", f"Encontrado outro mês '{sub_cell_b_val}' antes de achar cargo '{target_cargo}'.")
-                                      break
-                                 if sub_cell_b_val.strip().upper() == target_cargo.upper():
-                                      target_cargo_row_idx = cargo_search_row
-                                      self.log_message("DEBUG", f"Cargo '{target_cargo}' encontrado na linha {target_cargo_row_idx}, Col B.")
-                                      break
-
-                        if target_cargo_row_idx: break
-
-             if not target_cargo_row_idx:
-                 self.log_message("WARNING", f"Não foi possível encontrar a linha para Mês='{lookup_month}' e Cargo='{target_cargo}' na Coluna B do Excel.")
-                 return None
-
-             value_col_index = 3
-             ch_col_index = 3
-             vencimento_col_index = 4 # Col D
-             vencimento_cell_value = worksheet.cell(row=target_cargo_row_idx, column=vencimento_col_index).value
-             closest_row_idx = None
-             closest_distance = float('inf')
-             ch_number_for_closest = None
-             found_valid_value = False
-
-             if target_cargo_row_idx:
-                 rows_to_check = [target_cargo_row_idx]
-                 rows_to_check.extend([target_cargo_row_idx + 1, target_cargo_row_idx + 2])
-
-                 for row_idx in rows_to_check:
-                      if self.check_cancel(): return None
-                      for col_idx in range(vencimento_col_index, worksheet.max_column + 1):
-                           if self.check_cancel(): return None
-                           cell_value = worksheet.cell(row=row_idx, column=col_idx).value
-
-                           if cell_value is None or cell_value == "-":
-                                continue
-
-                           try:
-                               if isinstance(cell_value, str):
-                                    cell_value_float = locale.atof(cell_value.strip())
-                               else:
-                                    cell_value_float = float(cell_value)
-
-                               distance = abs(target_vencimento - cell_value_float)
-
-                               if distance < closest_distance:
-                                   closest_distance = distance
-                                   closest_row_idx = row_idx
-                                   ch_number_for_closest = worksheet.cell(row=closest_row_idx, column=ch_col_index).value
-                                   found_valid_value = True
-                                   if distance < 0.01:
-                                       break
-
-                           except (ValueError, TypeError) as e:
-                                self.log_message("DEBUG", f"Ignorando valor não numérico '{cell_value}' na célula [{row_idx},{col_idx}]: {e}")
-                                continue
-                      if closest_distance < 0.01:
-                           break
-                            
-                # --- Store results of the initial search ---
-                 initial_ch_number = None
-                 initial_distance = closest_distance
-                 initial_found = found_valid_value
-
-                 if initial_found:
-                     # Validate the initially found CH number
-                     if isinstance(ch_number_for_closest, (int, float)):
-                         initial_ch_number = ch_number_for_closest
-                     elif isinstance(ch_number_for_closest, str) and ch_number_for_closest.strip().isdigit():
-                         initial_ch_number = int(ch_number_for_closest)
-                     else:
-                         self.log_message("WARNING", f"Valor inicial encontrado para CH (Cargo: {target_cargo}) não é numérico: '{ch_number_for_closest}'. Tratando como não encontrado.")
-                         initial_found = False
-
-                 # --- Check if re-search is needed ---
-                 if initial_found and initial_distance > DIFFERENCE_THRESHOLD:
-                     self.log_message("WARNING", f"Diferença inicial ({initial_distance:.2f}) para Cargo '{target_cargo}' excede o limite ({DIFFERENCE_THRESHOLD}). Verificando cargo anterior.")
- 
-                     # Determine previous cargo
-                     previous_cargo = None
-                     try:
-                         parts = target_cargo.split('-')
-                         if len(parts) == 2 and parts[0].upper() == 'P':
-                             roman_part = parts[1].upper()
-                             if roman_part != 'I':
-                                 current_level = roman.fromRoman(roman_part)
-                                 if current_level > 1:
-                                     previous_level = current_level - 1
-                                     previous_cargo = f"P-{roman.toRoman(previous_level)}"
-                                     self.log_message("INFO", f"Cargo anterior determinado: {previous_cargo}")
-                     except Exception as e:
-                         self.log_message("WARNING", f"Não foi possível determinar cargo anterior para '{target_cargo}': {e}")
- 
-                     if previous_cargo:
-                         # --- Perform the second search using previous_cargo ---
-                         self.log_message("INFO", f"Realizando nova busca no Excel para Cargo '{previous_cargo}'...")
-                         prev_target_cargo_row_idx = None
-                         for row_idx in range(1, worksheet.max_row + 1):
-                             cell_b_val = worksheet.cell(row=row_idx, column=2).value # Col B = 2
-                             if isinstance(cell_b_val, str):
-                                 if row_idx > month_row_idx:
-                                     if cell_b_val.strip().upper() in [m.upper() for m in MONTHS]:
-                                         break
-                                     if cell_b_val.strip().upper() == previous_cargo.upper():
-                                         prev_target_cargo_row_idx = row_idx
-                                         self.log_message("DEBUG", f"Cargo anterior '{previous_cargo}' encontrado na linha {prev_target_cargo_row_idx}, Col B.")
-                                         break 
- 
-                         if prev_target_cargo_row_idx:
-                             prev_closest_distance = float('inf')
-                             prev_ch_number_for_closest = None
-                             prev_found_valid_value = False
-                             prev_closest_row_idx = None
-                             prev_rows_to_check = [prev_target_cargo_row_idx]
-                             prev_rows_to_check.extend([prev_target_cargo_row_idx + 1, prev_target_cargo_row_idx + 2])
- 
-                             for row_idx in prev_rows_to_check:
-                                 if self.check_cancel(): return None
-                                 for col_idx in range(vencimento_col_index, worksheet.max_column + 1):
-                                     if self.check_cancel(): return None
-                                     cell_value = worksheet.cell(row=row_idx, column=col_idx).value
-                                     if cell_value is None or cell_value == "-": continue
-                                     try:
-                                         if isinstance(cell_value, str): cell_value_float = locale.atof(cell_value.strip())
-                                         else: cell_value_float = float(cell_value)
- 
-                                         distance = abs(target_vencimento - cell_value_float)
-                                         # self.log_message("DEBUG", f"[Re-Search] Comparando Vencimento Base {target_vencimento} com Excel[{row_idx},{col_idx}] = {cell_value_float} (Dist: {distance})")
- 
-                                         if distance < prev_closest_distance:
-                                             prev_closest_distance = distance
-                                             prev_closest_row_idx = row_idx
-                                             prev_ch_number_for_closest = worksheet.cell(row=prev_closest_row_idx, column=ch_col_index).value
-                                             prev_found_valid_value = True
-                                             # self.log_message("DEBUG", f"[Re-Search] Novo valor mais próximo: {cell_value_float} na linha {prev_closest_row_idx}. CH={prev_ch_number_for_closest}")
-                                             if distance < 0.01: break
- 
-                                     except (ValueError, TypeError): continue
-                                 if prev_closest_distance < 0.01: break
- 
-                             # --- Compare results of initial and second search ---
-                             if prev_found_valid_value:
-                                 prev_ch_number_validated = None
-                                 if isinstance(prev_ch_number_for_closest, (int, float)):
-                                     prev_ch_number_validated = prev_ch_number_for_closest
-                                 elif isinstance(prev_ch_number_for_closest, str) and prev_ch_number_for_closest.strip().isdigit():
-                                     prev_ch_number_validated = int(prev_ch_number_for_closest)
- 
-                                 if prev_ch_number_validated is not None and prev_closest_distance < initial_distance:
-                                     self.log_message("INFO", f"Utilizando resultado da re-busca com Cargo '{previous_cargo}'. Distância: {prev_closest_distance:.2f} (CH: {prev_ch_number_validated}).")
-                                     return prev_ch_number_validated
-                                 else:
-                                     self.log_message("INFO", f"Re-busca com Cargo '{previous_cargo}' não produziu resultado melhor (Dist: {prev_closest_distance:.2f}). Mantendo resultado inicial (Dist: {initial_distance:.2f}).")
-                                     return initial_ch_number
-                             else:
-                                 self.log_message("INFO", f"Nenhum valor válido encontrado na re-busca com Cargo '{previous_cargo}'. Mantendo resultado inicial.")
-                                 return initial_ch_number
-                         else:
-                             self.log_message("INFO", f"Linha para Cargo anterior '{previous_cargo}' não encontrada. Mantendo resultado inicial.")
-                             return initial_ch_number
- 
-                     else:
-                         self.log_message("WARNING", f"Mantendo resultado inicial para Cargo '{target_cargo}' apesar da alta diferença ({initial_distance:.2f}). Não foi possível/necessário re-buscar cargo anterior.")
-                         return initial_ch_number
-                 elif initial_found:
-                     self.log_message("DEBUG", f"CH {initial_ch_number} encontrado para Cargo '{target_cargo}' com distância aceitável ({initial_distance:.2f}).")
-                     return initial_ch_number
-                 else:
-                     self.log_message("WARNING", f"Nenhum valor de vencimento correspondente encontrado no Excel para Mês='{lookup_month}', Cargo='{target_cargo}', Vencimento Base={target_vencimento}.")
-                     return None
- 
-             else:
-                 self.log_message("WARNING", "Lógica falhou em encontrar target_cargo_row_idx, apesar de month_row_idx ter sido encontrado.")
-                 return None
- 
-        self.log_message("WARNING", "Não foi possível determinar o número CH no Excel com a lógica atual (falha inicial na busca de mês/cargo).")
-        return None
+    def resolve_page_records(self, page_records, expected_years, entry_pages=None, entry_result=None):
+        """Resolves the CH of each page record as it arrives and yields (date, ch_number).
+
+        Year sheets are loaded on first use, together with the Referência years the
+        pre-scan expects, so a cold cache reads the workbook about once. Records are
+        appended to entry_pages/entry_result when given. Returns 'stopped' at the
+        Mar/2014 stop, 'done' when the records run out, None on error or cancellation.
+        """
+        salary_table = None
+        requested_years = {MISSING_YEARS.get(year, year) for year in expected_years}
+        for record in page_records:
+            if self.check_cancel(): return None
+            if record is None:
+                continue
+            page_num, referencia_year, excel_year, cargo_text, vencimento_associated = record
+            if entry_pages is not None:
+                entry_pages.append(record)
+
+            # --- Load the year sheet the first time a page needs it ---
+            if salary_table is None or salary_table.missing_sheets({excel_year}):
+                requested_years.add(excel_year)
+                salary_table = self.load_salary_table(requested_years)
+                if salary_table is None: return None
+            if not salary_table.has_year(excel_year):
+                self.log_message("ERROR", f"Planilha para o ano {excel_year} não encontrada no arquivo Excel: {EXCEL_FILE_PATH}. Pulando página {page_num + 1}.")
+                continue
+
+            # --- Resolve the CH of every month of the page in one batch ---
+            queries = []
+            query_months = []
+            for month_idx, current_month_abbr in enumerate(MONTHS):
+                vencimento_float_for_month = float(vencimento_associated[month_idx])
+                if vencimento_float_for_month == 0.0:
+                    continue
+                # Determine the month to use for Excel lookup (Dec for missing years)
+                lookup_month_excel = MONTHS[-1] if referencia_year in MISSING_YEARS else current_month_abbr
+                queries.append((excel_year, lookup_month_excel, cargo_text, vencimento_float_for_month))
+                query_months.append(current_month_abbr)
+            results = CH_RESOLUTION_CACHE.resolve(salary_table, queries) if queries else []
+
+            for current_month_abbr, query, result in zip(query_months, queries, results):
+                ch_number, distance, matched_cargo = result
+                context = f"Página {page_num + 1} ({current_month_abbr}/{referencia_year})"
+                self.log_ch_resolution(context, query, ch_number, distance, matched_cargo)
+                if ch_number is None:
+                    continue
+
+                self.log_message("INFO", f"{context}: CH encontrado = {ch_number}")
+                date = f"{MONTH_NUMBERS_MAP[current_month_abbr]}/{referencia_year}"
+                if entry_result is not None:
+                    entry_result['Date'].append(date)
+                    entry_result['Number'].append(str(ch_number))
+                yield date, str(ch_number)
+
+                # Check for the specific exit condition from legacy code
+                if referencia_year == PDF_STOP_YEAR and current_month_abbr == PDF_STOP_MONTH:
+                    self.log_message("INFO", f"Condição de parada ({PDF_STOP_MONTH}/{PDF_STOP_YEAR}) atingida na análise do PDF.")
+                    self.log_message("INFO", f"Cache de CH: {CH_RESOLUTION_CACHE.stats()}")
+                    return 'stopped'
+
+        # A record source stopped by cancellation (iter_pdf_pages_parallel) also just runs out
+        if self.check_cancel(): return None
+        self.log_message("INFO", f"Cache de CH: {CH_RESOLUTION_CACHE.stats()}")
+        return 'done'
+
+    def prescan_pdf_pages(self, pdf_document, prescan_mode):
+        """Returns the pages worth a full extraction, reading only page headers.
+
+        In 'bisect' mode the years are taken to be in ascending order, so the first page
+        from FIRST_PDF_YEAR and the first page after PDF_STOP_YEAR are found by bisection
+        on the header Referência year, reading O(log n) headers. If a probed header has no
+        Referência or the probed years are not ascending, or in 'header' mode, every header
+        is read and each page is kept or dropped on its own year (pages with no Referência
+        are left to extract_page_record). Returns (page numbers, Referência years expected
+        on them), or None if cancelled.
+        """
+        page_count = pdf_document.page_count
+        if prescan_mode == 'off':
+            return list(range(page_count)), set()
+        page_years = {}
+
+        def header_year(page_num):
+            if page_num not in page_years:
+                page_years[page_num] = read_header_referencia_year(pdf_document.load_page(page_num))
+            return page_years[page_num]
+
+        def first_page_after(year):
+            # Bisection for the first page whose year is > year; None if a header has no year
+            lo, hi = 0, page_count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                mid_year = header_year(mid)
+                if mid_year is None:
+                    return None
+                if mid_year > year:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return lo
+
+        first_page = end_page = None
+        if prescan_mode == 'bisect':
+            first_page = first_page_after(FIRST_PDF_YEAR - 1)
+            end_page = first_page_after(PDF_STOP_YEAR) if first_page is not None else None
+        probed_years = [page_years[page_num] for page_num in sorted(page_years)]
+        if end_page is not None and all(a <= b for a, b in zip(probed_years, probed_years[1:])):
+            page_nums = list(range(first_page, end_page))
+            expected_years = set()
+            if page_nums:
+                first_year, last_year = header_year(page_nums[0]), header_year(page_nums[-1])
+                expected_years = set(range(first_year, last_year + 1)) if first_year and last_year else set()
+            if first_page > 0:
+                self.log_message("INFO", f"Páginas 1-{first_page}: Anos anteriores a {FIRST_PDF_YEAR}. Pulando páginas.")
+            if end_page < page_count:
+                self.log_message("INFO", f"Páginas {end_page + 1}-{page_count}: Anos posteriores a {PDF_STOP_YEAR}. Pulando páginas.")
+        else:
+            if prescan_mode == 'bisect':
+                self.log_message("DEBUG", "Anos do PDF fora de ordem ou cabeçalho sem Referência. Lendo o cabeçalho de todas as páginas.")
+            page_nums = []
+            for page_num in range(page_count):
+                if self.check_cancel(): return None
+                referencia_year = header_year(page_num)
+                if referencia_year is not None and referencia_year < FIRST_PDF_YEAR:
+                    self.log_message("INFO", f"Página {page_num + 1}: Ano {referencia_year} < {FIRST_PDF_YEAR}. Pulando página.")
+                elif referencia_year is not None and referencia_year > PDF_STOP_YEAR:
+                    self.log_message("INFO", f"Página {page_num + 1}: Ano {referencia_year} posterior a {PDF_STOP_YEAR}. Pulando página.")
+                else:
+                    page_nums.append(page_num)
+            expected_years = {page_years[page_num] for page_num in page_nums} - {None}
+        self.log_message("DEBUG", f"Pré-varredura do PDF ({len(page_years)} cabeçalhos lidos, página: ano): {page_years}")
+        self.log_message("INFO", f"{len(page_nums)} de {page_count} páginas no intervalo {FIRST_PDF_YEAR}-{PDF_STOP_YEAR} serão analisadas.")
+        return page_nums, expected_years
+
+    def iter_pdf_pages_parallel(self, pdf_file_path, page_nums, workers, extraction_mode):
+        """Extracts the page records with a process pool, each worker opening the PDF itself.
+
+        Pages are split into chunks of PDF_PAGES_PER_TASK and yielded in page order. At
+        most two chunks per worker are in flight, so finished records do not pile up
+        ahead of the consumer. Stops early if cancellation is requested while waiting;
+        the consumer tells that from the end of the pages by checking check_cancel().
+        """
+        self.log_message("INFO", f"Analisando páginas do PDF em paralelo ({workers} processos)...")
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_pdf_worker,
+            initargs=(locale.setlocale(locale.LC_NUMERIC),)
+        )
+        chunks = iter([page_nums[i:i + PDF_PAGES_PER_TASK] for i in range(0, len(page_nums), PDF_PAGES_PER_TASK)])
+        futures = deque()
+        try:
+            for chunk in itertools.islice(chunks, 2 * workers):
+                futures.append(executor.submit(parse_pdf_page_range, pdf_file_path, chunk, extraction_mode))
 
+            while futures:
+                future = futures.popleft()
+                while True:
+                    if self.check_cancel(): return
+                    try:
+                        page_results = future.result(timeout=0.2)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        continue
+                for chunk in itertools.islice(chunks, 1):
+                    futures.append(executor.submit(parse_pdf_page_range, pdf_file_path, chunk, extraction_mode))
+                for page_num, record, messages in page_results:
+                    for level, message in messages:
+                        self.log_message(level, message)
+                    yield record
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def load_salary_table(self, years):
+        """Loads the vencimentos salary table with at least the given year sheets. Returns None on failure.
+
+        The on-disk cache is reused while the workbook is unchanged; year sheets it does
+        not hold yet are streamed from the workbook and the extended table is saved to a
+        new versioned file (see get_versioned_salary_cache_path), never over a mapped one.
+        """
+        cache_path = get_salary_cache_path()
+        try:
+            source_signature = get_file_signature(EXCEL_FILE_PATH)
+        except FileNotFoundError:
+            self.log_message("ERROR", f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}")
+            self.result_queue.put(Exception(f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}"))
+            return None
+        except OSError as e:
+            self.log_message("ERROR", ERROR_OPENING_EXCEL_FILE_MSG.format(e))
+            self.result_queue.put(Exception(ERROR_OPENING_EXCEL_FILE_MSG.format(e)))
+            return None
 
-    def scrape_rhnet(self, username, password, cpf):
-        """Logs into RHNet, navigates, and scrapes financial data. (Adapted from legacy)"""
-        driver = None
-        scraped_data = {'Number': [], 'Date': []}
-        server_info = {'nome': 'N/A', 'cargo': 'N/A', 'referencia': 'N/A'}
+        # The compiled table holding most of the requested years, then most sheets
+        cached_table = None
+        sheets_to_load = None
+        cached_sheets = {} # path -> loaded sheets of every table found (empty when outdated or unreadable)
+        for candidate_path in get_salary_cache_candidates(cache_path):
+            cached_sheets[candidate_path] = set()
+            try:
+                candidate = SalaryTable.load_compiled(candidate_path, source_signature)
+            except Exception as e:
+                self.log_message("WARNING", f"Não foi possível ler o cache da tabela de vencimentos ({candidate_path}): {e}. Ignorando.")
+                continue
+            if candidate is None:
+                continue
+            cached_sheets[candidate_path] = set(candidate.loaded_sheets)
+            missing = candidate.missing_sheets(years)
+            if cached_table is None or (len(missing), -len(candidate.loaded_sheets)) < (len(sheets_to_load), -len(cached_table.loaded_sheets)):
+                cached_table, sheets_to_load = candidate, missing
+        if cached_table is None:
+            self.log_message("DEBUG", "Cache da tabela de vencimentos ausente ou desatualizado.")
+
+        if cached_table is not None:
+            if not sheets_to_load:
+                self.log_message("INFO", f"Tabela de vencimentos carregada do cache ({len(cached_table.loaded_sheets)} planilhas).")
+                return cached_table
+        else:
+            sheets_to_load = {str(year) for year in years}
 
+        self.log_message("INFO", f"Carregando planilhas {', '.join(sorted(sheets_to_load))} do Excel de vencimentos...")
         try:
-            options = webdriver.ChromeOptions()
-            options.add_argument("--headless")
-            options.add_argument("--disable-gpu")
-            options.add_argument("--no-sandbox")
-            options.add_argument("--window-size=1920,1080")
-            options.add_argument('log-level=3')
-            options.add_experimental_option('excludeSwitches', ['enable-logging'])
-
-            # Use ChromeDriverManager to automatically handle chromedriver
-            self.log_message("DEBUG", "Verificando/Instalando chromedriver compatível...")
-            try:
-                suggested_path = ChromeDriverManager().install()
+            salary_table = SalaryTable.from_workbook(EXCEL_FILE_PATH, years=sheets_to_load)
+        except FileNotFoundError:
+            self.log_message("ERROR", f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}")
+            self.result_queue.put(Exception(f"Arquivo Excel não encontrado: {EXCEL_FILE_PATH}"))
+            return None
+        except Exception as e:
+            self.log_message("ERROR", ERROR_OPENING_EXCEL_FILE_MSG.format(e))
+            self.result_queue.put(Exception(ERROR_OPENING_EXCEL_FILE_MSG.format(e)))
+            return None
+        if cached_table is not None:
+            salary_table = cached_table.merged_with(salary_table) # Copies the arrays, the mapped file is not needed
+        salary_table.version = source_signature['sha256']
+        self.log_message("DEBUG", f"Tabela de vencimentos carregada ({len(salary_table.loaded_sheets)} de {len(salary_table.sheet_names)} planilhas).")
 
-                driver_path = suggested_path
-                expected_exe_name = "chromedriver.exe"
-                if not suggested_path.lower().endswith(expected_exe_name.lower()):
-                    self.log_message("WARNING", f"Path do webdriver-manager ('{os.path.basename(suggested_path)}') não parece ser o executável ('{expected_exe_name}'). Tentando corrigir...")
-                    driver_dir = os.path.dirname(suggested_path)
-                    corrected_path = os.path.join(driver_dir, expected_exe_name)
-                    if os.path.exists(corrected_path):
-                        self.log_message("INFO", f"Usando path corrigido: {corrected_path}")
-                        driver_path = corrected_path
-                    else:
-                        self.log_message("ERROR", f"Path corrigido '{corrected_path}' não encontrado. Usando path original.")
-                        driver_path = suggested_path
-                
-                self.log_message("DEBUG", f"Tentando configurar Service com executable_path: {driver_path}")
-                service = Service(executable_path=driver_path)
-                self.log_message("DEBUG", "Service configurado.")
+        saved_path = get_versioned_salary_cache_path(cache_path, salary_table)
+        try:
+            if not os.path.exists(saved_path): # Same workbook and sheets: same content
+                salary_table.save_compiled(saved_path, source_signature)
+            self.log_message("DEBUG", f"Cache da tabela de vencimentos salvo em: {saved_path}")
+        except Exception as e:
+            self.log_message("WARNING", f"Não foi possível salvar o cache da tabela de vencimentos: {e}")
+            return salary_table
 
-                driver = webdriver.Chrome(service=service, options=options)
-                self.log_message("DEBUG", "Instância do WebDriver criada com sucesso.")
-                driver.implicitly_wait(5)
-
-            except OSError as e:
-                 self.log_message("ERROR", f"Erro de Sistema ao obter/usar chromedriver: {e}")
-                 if isinstance(e, FileNotFoundError):
-                     self.log_message("ERROR", f"O arquivo chromedriver '{driver_path}' não foi encontrado.")
-                 elif isinstance(e, PermissionError):
-                      self.log_message("ERROR", f"Sem permissão para executar chromedriver '{driver_path}'.")
-                 elif "[WinError 193]" in str(e):
-                      self.log_message("ERROR", f"O arquivo '{driver_path}' não é um executável válido (WinError 193). Verifique o cache .wdm ou atualize webdriver-manager.")
-                 else:
-                      self.log_message("ERROR", f"Erro OS não específico: {e}")
-
-                 self.log_message("ERROR", "Verifique também se o Chrome está instalado e atualizado.")
-                 self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver (OSError): {e}"))
-                 return None, None
-            except Exception as e_manager:
-                 self.log_message("ERROR", f"Erro ao inicializar webdriver-manager ou Service: {e_manager}")
-                 import traceback
-                 self.log_message("ERROR", traceback.format_exc())
-                 self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver: {e_manager}"))
-                 return None, None
-
-            except OSError as e:
-                self.log_message("ERROR", f"Erro de Sistema ao obter/usar chromedriver: {e}")
-                self.log_message("ERROR", "Verifique se há problemas no cache do webdriver-manager (~/.wdm) ou permissões.")
-                self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver (OSError): {e}"))
-                return None, None
-            except Exception as e_manager:
-                self.log_message("ERROR", f"Erro ao inicializar webdriver-manager ou Service: {e_manager}")
-                self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver: {e_manager}"))
-                return None, None
-
-            driver.get("https://aplicacoes.expresso.go.gov.br")
-
-            # --- Login ---
-            if self.check_cancel(): return None, None
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.ID, "usernameUserInput"))).send_keys(username)
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.ID, "password"))).send_keys(password)
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.element_to_be_clickable((By.XPATH, '//button[@type="submit"]'))).click()
-
-            # --- Navigation ---
-            if self.check_cancel(): driver.quit(); return None, None
-            time.sleep(1)
-
-            # Wait for and click the 'people' icon
-            # Updated XPath to find the element by the text "RHNet"
-            rhnet_xpath = "//h3[normalize-space()='RHNet']"
-
-            # Wait for it to be clickable
-            rhnet_link = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, rhnet_xpath)))
-            rhnet_link.click()
-            time.sleep(2)
-
-            if self.check_cancel(): driver.quit(); return None, None
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "menu")))
-
-            # Hover over and click 'Processamento' (using ActionChains)
-            processamento_button = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.visibility_of_element_located((By.XPATH, '/html/body/div[2]/div[3]'))) # Adjust XPath if needed
-            actions = ActionChains(driver).move_to_element(processamento_button)
-            actions.click().perform()
-            time.sleep(1)
-
-            # Switch back to default content, then to 'principal' frame
-            driver.switch_to.default_content()
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "principal")))
-
-            # Hover over and click 'Consultar Ficha Financeira'
-            consultar_ficha_button = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.visibility_of_element_located((By.XPATH, '//div[contains(text(), "Consultar Ficha Financeira")]')))
-            ActionChains(driver).move_to_element(consultar_ficha_button).click().perform()
-            time.sleep(1)
-
-            # Hover over and click 'Servidor'
-            servidor_button = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.visibility_of_element_located((By.XPATH, '//div[text()="Servidor"]')))
-            ActionChains(driver).move_to_element(servidor_button).click().perform()
-            time.sleep(1)
-
-            # --- Fill Search Form ---
-            if self.check_cancel(): driver.quit(); return None, None
-            orgao_xpath = '/html/body/form/center[1]/table/tbody/tr[1]/td[2]/input[2]'
-            orgao_textbox = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, orgao_xpath)))
-            orgao_textbox.send_keys(ORGÃO_RHNET)
-            time.sleep(1)
-
-            # CPF textbox
-            cpf_xpath = '/html/body/form/center[1]/table/tbody/tr[2]/td[2]/input'
-            cpf_textbox = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, cpf_xpath)))
-            cpf_textbox.send_keys(cpf)
-            time.sleep(1)
-
-            # First Dropdown (Tipo Vínculo) - select by index 1 (second option)
-            dropdown1_xpath = '/html/body/form/center[1]/table/tbody/tr[3]/td[2]/select'
-            select1 = Select(WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, dropdown1_xpath))))
-            select1.select_by_index(1)
-            time.sleep(2)
-
-            # Second Dropdown (Matrícula) - select by index 1 (second option)
-            dropdown2_xpath = '/html/body/form/center[1]/table/tbody/tr[4]/td[2]/select'
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(lambda d: len(Select(d.find_element(By.XPATH, dropdown2_xpath)).options) > 1)
-            select2 = Select(driver.find_element(By.XPATH, dropdown2_xpath))
-            select2.select_by_index(1)
-            time.sleep(1)
-
-            # --- Click Consultar ---
-            if self.check_cancel(): driver.quit(); return None, None
-            consultar_btn_xpath = '/html/body/form/center[2]/input[1]'
-            WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.element_to_be_clickable((By.XPATH, consultar_btn_xpath))).click()
-            time.sleep(2)
-
-            # --- Select Record and Get Details ---
-            if self.check_cancel(): driver.quit(); return None, None
-            try:
-                # Click checkbox (adjust XPath/ID if needed, 'marca_desmarca' from legacy)
-                checkbox_id = 'marca_desmarca'
-                WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.element_to_be_clickable((By.ID, checkbox_id))).click()
-                time.sleep(0.5)
-
-                # Click 'Detalhar' button
-                detalhar_btn_xpath = '/html/body/form/center[3]/input[2]'
-                WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.element_to_be_clickable((By.XPATH, detalhar_btn_xpath))).click()
-                time.sleep(2)
-
-            except (TimeoutException, NoSuchElementException) as e:
-                self.log_message("ERROR", f"Não foi possível selecionar ou detalhar o registro do servidor: {e}. Verifique o CPF ou se há registros.")
-                driver.quit()
-                self.result_queue.put(Exception(f"Registro não encontrado/selecionável para CPF {cpf}."))
-                return None, None
-
-            # --- Extract Server Info (Nome, Cargo, Referência) ---
-            if self.check_cancel(): driver.quit(); return None, None
-            try:
-                WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.visibility_of_element_located((By.XPATH, '/html/body/form/center[1]/table/tbody/tr[4]/td[2]'))) # Nome element
+        # Versioned tables the new one supersedes; a file still mapped elsewhere is left for a later run
+        for old_path, old_sheets in cached_sheets.items():
+            if old_path not in (cache_path, saved_path) and old_sheets <= set(salary_table.loaded_sheets):
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return salary_table
+
+    def log_ch_resolution(self, context, query, ch_number, distance, matched_cargo):
+        """Logs how the CH of one (year, month, cargo, vencimento) query was resolved."""
+        excel_year, lookup_month, target_cargo, target_vencimento = query
+        if ch_number is None:
+            self.log_message("WARNING", f"{context}: Nenhum valor de vencimento correspondente encontrado no Excel para Planilha={excel_year}, Mês='{lookup_month}', Cargo='{target_cargo}', Vencimento Base={target_vencimento}.")
+        elif matched_cargo != target_cargo:
+            self.log_message("INFO", f"{context}: Diferença para Cargo '{target_cargo}' excede o limite ({DIFFERENCE_THRESHOLD}). Utilizando resultado da re-busca com Cargo '{matched_cargo}'. Distância: {distance:.2f} (CH: {ch_number}).")
+        elif distance > DIFFERENCE_THRESHOLD:
+            self.log_message("WARNING", f"{context}: Mantendo resultado para Cargo '{target_cargo}' apesar da alta diferença ({distance:.2f}).")
+        else:
+            self.log_message("DEBUG", f"{context}: CH {ch_number} encontrado para Cargo '{target_cargo}' com distância aceitável ({distance:.2f}).")
 
-                nome_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[4]/td[2]')
-                cargo_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[5]/td[2]')
-                referencia_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[6]/td[2]')
+    def find_ch_in_excel(self, salary_table, excel_year, lookup_month, target_cargo, target_vencimento):
+        """Finds the CH number in the salary table matching month, cargo, and closest value."""
+        self.log_message("DEBUG", f"Buscando no Excel: Mês='{lookup_month}', Cargo='{target_cargo}', Vencimento Base={target_vencimento}")
+        query = (excel_year, lookup_month, target_cargo, target_vencimento)
+        ch_number, distance, matched_cargo = CH_RESOLUTION_CACHE.resolve(salary_table, [query])[0]
+        self.log_ch_resolution(f"Planilha {excel_year}", query, ch_number, distance, matched_cargo)
+        return ch_number
 
-                server_info['nome'] = nome_element.text.strip()
-                server_info['cargo'] = cargo_element.text.strip()
-                server_info['referencia'] = referencia_element.text.strip()
 
-                self.log_message("INFO", f"Nome: {server_info['nome']}")
-                self.log_message("INFO", f"Cargo: {server_info['cargo']}")
-                self.log_message("INFO", f"Referência: {server_info['referencia']}")
+    def start_chrome_driver(self):
+        """Starts a new headless Chrome. Returns the driver, or None on failure (already reported)."""
+        driver = None
+        driver_path = None
+        profile = read_config_option('RHNet', 'browser_profile', DEFAULT_BROWSER_PROFILE).strip().lower()
+        if profile not in BROWSER_PROFILES:
+            self.log_message("WARNING", f"Perfil de navegador inválido '{profile}'. Usando '{DEFAULT_BROWSER_PROFILE}'.")
+            profile = DEFAULT_BROWSER_PROFILE
+        options = build_chrome_options(profile)
+
+        # Reuse the chromedriver saved in config.ini; webdriver-manager only when Chrome changed
+        self.log_message("DEBUG", "Verificando/Instalando chromedriver compatível...")
+        try:
+            start_time = time.perf_counter()
+            driver_path, saved_driver = self.resolve_chromedriver_path()
 
-            except (TimeoutException, NoSuchElementException) as e:
-                self.log_message("WARNING", f"Não foi possível extrair informações detalhadas do servidor (Nome/Cargo/Ref): {e}")
+            self.log_message("DEBUG", f"Tentando configurar Service com executable_path: {driver_path}")
+            service = Service(executable_path=driver_path)
+            self.log_message("DEBUG", "Service configurado.")
 
-            # --- Scrape Historical Data (Iteratively click "Recuar") ---
-            page_count = 0
-            max_pages = 300
+            try:
+                driver = webdriver.Chrome(service=service, options=options)
+            except SessionNotCreatedException:
+                if not saved_driver or read_config_int('RHNet', 'chromedriver_offline', 0):
+                    raise
+                self.log_message("WARNING", "O chromedriver salvo não é compatível com o Chrome instalado. Obtendo outro...")
+                driver_path, _ = self.resolve_chromedriver_path(refresh=True)
+                driver = webdriver.Chrome(service=Service(executable_path=driver_path), options=options)
+            self.log_message("DEBUG", f"Instância do WebDriver criada com sucesso em {time.perf_counter() - start_time:.2f}s (perfil '{profile}').")
+            driver.implicitly_wait(5)
+            if profile == 'lean':
+                try:
+                    driver.execute_cdp_cmd('Network.enable', {})
+                    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URL_PATTERNS})
+                except WebDriverException as e:
+                    self.log_message("WARNING", f"Não foi possível bloquear recursos das páginas via CDP: {e.msg}")
+
+        except OSError as e:
+             self.log_message("ERROR", f"Erro de Sistema ao obter/usar chromedriver: {e}")
+             if isinstance(e, FileNotFoundError):
+                 self.log_message("ERROR", f"O arquivo chromedriver '{driver_path}' não foi encontrado.")
+             elif isinstance(e, PermissionError):
+                  self.log_message("ERROR", f"Sem permissão para executar chromedriver '{driver_path}'.")
+             elif "[WinError 193]" in str(e):
+                  self.log_message("ERROR", f"O arquivo '{driver_path}' não é um executável válido (WinError 193). Verifique o cache .wdm ou atualize webdriver-manager.")
+             else:
+                  self.log_message("ERROR", f"Erro OS não específico: {e}")
+
+             self.log_message("ERROR", "Verifique também se o Chrome está instalado e atualizado.")
+             self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver (OSError): {e}"))
+             return None
+        except Exception as e_manager:
+             self.log_message("ERROR", f"Erro ao inicializar webdriver-manager ou Service: {e_manager}")
+             import traceback
+             self.log_message("ERROR", traceback.format_exc())
+             self.result_queue.put(Exception(f"Falha ao iniciar ChromeDriver: {e_manager}"))
+             return None
+        return driver
+
+    def resolve_chromedriver_path(self, refresh=False):
+        """Returns (chromedriver path, whether it was the one saved in config.ini).
+
+        The saved [RHNet] chromedriver_path is used without checking the installed Chrome,
+        whose version query starts shell processes on Windows. When there is none, or Chrome
+        rejected it (refresh), webdriver-manager resolves, and possibly downloads, a driver
+        for the installed Chrome version and the result is saved. With chromedriver_offline = 1
+        the saved driver is always used and webdriver-manager is never called.
+        """
+        saved_path = read_config_option('RHNet', 'chromedriver_path')
+        saved_version = read_config_option('RHNet', 'chromedriver_chrome_version', '')
+        offline = read_config_int('RHNet', 'chromedriver_offline', 0)
+
+        if saved_path and os.path.isfile(saved_path) and (not refresh or offline):
+            self.log_message("DEBUG", f"Usando chromedriver salvo (Chrome {saved_version or 'versão desconhecida'}): {saved_path}")
+            return saved_path, True
+        if offline:
+            raise FileNotFoundError(f"Modo offline (chromedriver_offline = 1) sem chromedriver válido em [RHNet] chromedriver_path: {saved_path}")
+        chrome_version = detect_chrome_version()
+
+        self.log_message("INFO", f"Obtendo chromedriver compatível com o Chrome {chrome_version or 'instalado'} (webdriver-manager)...")
+        suggested_path = ChromeDriverManager().install()
+
+        driver_path = suggested_path
+        expected_exe_name = "chromedriver.exe" if os.name == 'nt' else "chromedriver"
+        if os.path.basename(suggested_path).lower() != expected_exe_name:
+            self.log_message("WARNING", f"Path do webdriver-manager ('{os.path.basename(suggested_path)}') não parece ser o executável ('{expected_exe_name}'). Tentando corrigir...")
+            driver_dir = os.path.dirname(suggested_path)
+            corrected_path = os.path.join(driver_dir, expected_exe_name)
+            if os.path.exists(corrected_path):
+                self.log_message("INFO", f"Usando path corrigido: {corrected_path}")
+                driver_path = corrected_path
+            else:
+                self.log_message("ERROR", f"Path corrigido '{corrected_path}' não encontrado. Usando path original.")
+                driver_path = suggested_path
 
-            while page_count < max_pages:
-                page_count += 1
-                if self.check_cancel(): driver.quit(); return None, None
+        try:
+            write_config_options('RHNet', {'chromedriver_path': driver_path, 'chromedriver_chrome_version': chrome_version or ''})
+            self.log_message("DEBUG", f"chromedriver salvo no {CONFIG_FILE}: {driver_path}")
+        except OSError as e:
+            self.log_message("WARNING", f"Não foi possível salvar o chromedriver no {CONFIG_FILE}: {e}")
+        return driver_path, False
+
+    def acquire_rhnet_driver(self, username, password):
+        """Returns (driver, waiter) with the browser on the Consultar Ficha Financeira → Servidor form.
+
+        A driver parked in BROWSER_POOL for this user is reused when it still responds;
+        otherwise a new Chrome is started and logged in. Returns (None, None) on
+        failure (already reported) or cancellation.
+        """
+        policy = WaitPolicy.from_config()
+        driver = BROWSER_POOL.borrow(username)
+        if driver is not None:
+            self.log_message("INFO", "Reutilizando navegador já autenticado no RHNet.")
+            waiter = self.reset_pooled_driver(driver, username, password, policy)
+            if waiter is not None:
+                return driver, waiter
+            if self.check_cancel(): return None, None
 
-                # Extract Date
-                date_text = "N/A"
-                try:
-                    date_xpath = '/html/body/form/center[1]/table/tbody/tr[1]/td[4]'
-                    date_element = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.visibility_of_element_located((By.XPATH, date_xpath)))
-                    date_text = date_element.text.strip()
-                    if not re.match(r"\d{2}/\d{4}", date_text):
-                         self.log_message("WARNING", f"Formato de data inesperado na pág {page_count}: '{date_text}'. Tentando continuar.")
-                except (TimeoutException, NoSuchElementException):
-                    self.log_message("WARNING", f"Não foi possível encontrar a data na página {page_count}.")
-
-                # Extract VENCIMENTO EFETIVO Number
-                number_text = ""
-                try:
-                    # Locate the cell with the text "VENCIMENTO EFETIVO" (case-insensitive search might be safer)
-                    venc_label_xpath = '//td[contains(translate(text(), "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"), "vencimento efetivo")]'
-                    vencimento_efetivo_cell = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, venc_label_xpath)))
-
-                    # Get the number located in the cell directly to the right
-                    next_cell = vencimento_efetivo_cell.find_element(By.XPATH, './following-sibling::td[1]')
-                    number_text_raw = next_cell.text.strip()
-
-                    # Clean the number (remove R$, convert comma decimal to dot)
-                    number_text_raw = number_text_raw.replace("R$", "").strip()
-                    if number_text_raw:
-                        try:
-                            number_float = locale.atof(number_text_raw)
-                            number_text = f"{number_float:.2f}".replace('.', ',')
-                            number_text = f"{number_float:.2f}"
-                            self.log_message("DEBUG", f"Pág {page_count} ({date_text}): Vencimento Efetivo = {number_text_raw} -> {number_text}")
-                        except ValueError:
-                            self.log_message("WARNING", f"Pág {page_count} ({date_text}): Não foi possível converter Vencimento Efetivo '{number_text_raw}' para número.")
-                            number_text = ""
-                    else:
-                        number_text = ""
+        driver = self.start_chrome_driver()
+        if driver is None:
+            return None, None
+        try:
+            waiter = PageWaiter(driver, policy, self.log_message)
+            if self.login_rhnet(driver, waiter, username, password) and self.open_ficha_form(driver, waiter):
+                return driver, waiter
+        except Exception:
+            driver.quit()
+            raise
+        driver.quit()
+        return None, None
+
+    def reset_pooled_driver(self, driver, username, password, policy):
+        """Brings a pooled driver back to the search form, logging in again if the session expired.
+
+        Returns the driver's PageWaiter, or None (driver quit) when the browser does not
+        respond or cancellation is requested.
+        """
+        try:
+            driver.switch_to.default_content() # Fails right away if the browser is gone
+            quick_policy = WaitPolicy(min(policy.timeout, BROWSER_POOL_RESET_TIMEOUT), policy.poll_interval)
+            try:
+                if self.open_ficha_form(driver, PageWaiter(driver, quick_policy, self.log_message)):
+                    return PageWaiter(driver, policy, self.log_message)
+            except TimeoutException:
+                self.log_message("INFO", "Sessão do RHNet expirada ou menu indisponível. Fazendo login novamente...")
+                waiter = PageWaiter(driver, policy, self.log_message)
+                if self.login_rhnet(driver, waiter, username, password) and self.open_ficha_form(driver, waiter):
+                    return waiter
+        except WebDriverException as e:
+            self.log_message("WARNING", f"Navegador reservado não respondeu ({e.msg}). Iniciando um novo.")
+        BrowserPool.quit_quietly(driver)
+        return None
 
-                except (TimeoutException, NoSuchElementException):
-                    self.log_message("DEBUG", f"Pág {page_count} ({date_text}): 'VENCIMENTO EFETIVO' não encontrado ou valor adjacente ausente.")
-                    number_text = "" # Append empty string as per legacy logic
+    def login_rhnet(self, driver, waiter, username, password):
+        """Opens the Expresso portal, logs in if asked to and enters RHNet. Returns False on cancellation."""
+        driver.get(RHNET_PORTAL_URL)
+
+        # --- Login ---
+        if self.check_cancel(): return False
+        rhnet_xpath = "//h3[normalize-space()='RHNet']"
+        waiter.until(EC.any_of(EC.presence_of_element_located((By.ID, "usernameUserInput")),
+                               EC.element_to_be_clickable((By.XPATH, rhnet_xpath))), "página de login")
+        if driver.find_elements(By.ID, "usernameUserInput"):
+            waiter.until(EC.presence_of_element_located((By.ID, "usernameUserInput")), "campo de login").send_keys(username)
+            waiter.until(EC.presence_of_element_located((By.ID, "password")), "campo de senha").send_keys(password)
+            waiter.until(EC.element_to_be_clickable((By.XPATH, '//button[@type="submit"]')), "botão de login").click()
+
+        # --- Navigation ---
+        if self.check_cancel(): return False
+
+        # Wait for and click the 'people' icon (found by the text "RHNet")
+        rhnet_link = waiter.until(EC.element_to_be_clickable((By.XPATH, rhnet_xpath)), "link RHNet")
+        rhnet_link.click()
+        return True
 
-                # Store extracted data
-                if date_text != "N/A":
-                    scraped_data['Number'].append(number_text)
-                    scraped_data['Date'].append(date_text)
-                else:
-                    self.log_message("WARNING", f"Pág {page_count}: Ignorando registro devido à data ausente.")
+    def open_ficha_form(self, driver, waiter):
+        """Opens Processamento → Consultar Ficha Financeira → Servidor from the RHNet frames. Returns False on cancellation."""
+        if self.check_cancel(): return False
+        driver.switch_to.default_content()
+        waiter.until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "menu")), "frame 'menu'")
 
+        # Hover over and click 'Processamento' (using ActionChains)
+        processamento_button = waiter.until(EC.visibility_of_element_located((By.XPATH, '/html/body/div[2]/div[3]')), "menu Processamento") # Adjust XPath if needed
+        actions = ActionChains(driver).move_to_element(processamento_button)
+        actions.click().perform()
 
-                # Attempt to click "Recuar"
-                try:
-                    recuar_xpath = '/html/body/form/center[3]/input[1]'
-                    recuar_button = WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.element_to_be_clickable((By.XPATH, recuar_xpath)))
-                    if recuar_button.is_enabled():
-                         recuar_button.click()
-                         try:
-                             WebDriverWait(driver, SELENIUM_TIMEOUT).until(EC.staleness_of(recuar_button))
-                         except TimeoutException:
-                             self.log_message("WARNING", f"Pág {page_count}: Botão 'Recuar' não ficou obsoleto após clique. A página pode não ter atualizado.")
-                             time.sleep(1)
-                    else:
-                         self.log_message("INFO", f"Pág {page_count}: Botão 'Recuar' está desabilitado. Fim do histórico alcançado.")
-                         break
+        # Switch back to default content, then to 'principal' frame
+        driver.switch_to.default_content()
+        waiter.until(EC.frame_to_be_available_and_switch_to_it((By.NAME, "principal")), "frame 'principal'")
 
-                except (TimeoutException, NoSuchElementException):
-                    self.log_message("INFO", f"Pág {page_count}: Botão 'Recuar' não encontrado ou clicável. Assumindo fim do histórico.")
-                    break 
-                except Exception as e:
-                     self.log_message("ERROR", f"Erro inesperado ao clicar/esperar 'Recuar' na pág {page_count}: {e}")
-                     break
+        # Hover over and click 'Consultar Ficha Financeira'
+        consultar_ficha_button = waiter.until(EC.visibility_of_element_located((By.XPATH, '//div[contains(text(), "Consultar Ficha Financeira")]')), "menu Consultar Ficha Financeira")
+        ActionChains(driver).move_to_element(consultar_ficha_button).click().perform()
 
+        # Hover over and click 'Servidor'
+        servidor_button = waiter.until(EC.visibility_of_element_located((By.XPATH, '//div[text()="Servidor"]')), "menu Servidor")
+        ActionChains(driver).move_to_element(servidor_button).click().perform()
+        return True
 
-            if page_count >= max_pages:
-                 self.log_message("WARNING", f"Atingido limite máximo de páginas ({max_pages}) ao clicar em 'Recuar'.")
+    def scrape_rhnet(self, username, password, cpf):
+        """Logs into RHNet, navigates, and scrapes financial data. (Adapted from legacy)
 
+        Returns (driver, {'data': ..., 'info': ...}) or (None, None). With [RHNet]
+        all_matriculas = 1 every vínculo/matrícula of the CPF is scraped and the result
+        also holds 'matriculas', a list of (matrícula, data).
+        """
+        driver = None
+        try:
+            driver, waiter = self.acquire_rhnet_driver(username, password)
+            if driver is None: return None, None
+            if not self.fill_search_form(driver, waiter, cpf): driver.quit(); return None, None
+
+            if read_config_int('RHNet', 'all_matriculas', 0):
+                combos = self.list_matriculas(driver, waiter)
+                if combos is None: driver.quit(); return None, None
+                if len(combos) > 1:
+                    return self.scrape_all_matriculas(driver, waiter, username, password, cpf, combos)
+
+            matricula = self.select_matricula(driver, waiter)
+            result = self.scrape_selected_matricula(driver, waiter, cpf, matricula)
+            if result is None: driver.quit(); return None, None
+            scraped_data, server_info = result
             self.log_message("INFO", "Extração do RHNet concluída")
-
             return driver, {'data': scraped_data, 'info': server_info}
 
-        except WebDriverException as e:
-            self.log_message("ERROR", f"Erro de WebDriver: {e}")
-            if "net::ERR_CONNECTION_REFUSED" in str(e) or "page crash" in str(e):
-                 self.log_message("ERROR", "Verifique se o navegador está instalado/atualizado ou se a página está acessível.")
-            self.result_queue.put(Exception(f"Erro de WebDriver: {e}"))
+        except Exception as e:
+            self.report_rhnet_error(e)
             if driver: driver.quit()
             return None, None
-        except TimeoutException as e:
+
+    def report_rhnet_error(self, e):
+        """Logs an error raised while driving RHNet and puts it on the result queue.
+
+        While run_rhnet_stage has retries left, an error in RHNET_TRANSIENT_ERRORS raised
+        during the history walk (before it, one in RHNET_CONNECTION_ERRORS) is only logged
+        and flags the retry instead. Returns True in that case.
+        """
+        retryable = RHNET_TRANSIENT_ERRORS if self.rhnet_walk_started else RHNET_CONNECTION_ERRORS
+        if self.rhnet_retry_allowed and isinstance(e, retryable):
+            self.rhnet_retry_requested = True
+            self.log_message("WARNING", f"Falha no RHNet, o que já foi extraído está salvo: {getattr(e, 'msg', None) or e}")
+            return True
+        if isinstance(e, TimeoutException):
             self.log_message("ERROR", f"Tempo limite excedido esperando por elemento: {e.msg}")
             self.result_queue.put(Exception(f"Tempo limite excedido: {e.msg}"))
-            if driver: driver.quit()
-            return None, None
-        except Exception as e:
+        elif isinstance(e, WebDriverException):
+            self.log_message("ERROR", f"Erro de WebDriver: {e}")
+            if "net::ERR_CONNECTION_REFUSED" in str(e) or "page crash" in str(e):
+                 self.log_message("ERROR", "Verifique se o navegador está instalado/atualizado ou se a página está acessível.")
+            self.result_queue.put(Exception(f"Erro de WebDriver: {e}"))
+        else:
             self.log_message("ERROR", f"Erro inesperado durante scraping: {e}")
             import traceback
             self.log_message("ERROR", traceback.format_exc())
             self.result_queue.put(Exception(f"Erro inesperado no scraping: {e}"))
+        if not self.rhnet_walk_started and not isinstance(e, RHNET_CONNECTION_ERRORS):
+            self.rhnet_failed_before_walk = True
+        return False
+
+    def list_matriculas(self, driver, waiter):
+        """Lists the (vínculo index, matrícula index, matrícula) choices of the filled search form.
+
+        Returns None on cancellation.
+        """
+        waiter.until(select_has_options(RHNET_VINCULO_SELECT_XPATH), "lista Tipo Vínculo")
+        vinculos = [option.text.strip() for option in Select(driver.find_element(By.XPATH, RHNET_VINCULO_SELECT_XPATH)).options][1:]
+        combos = []
+        previous_options = None
+        for vinculo_index, vinculo in enumerate(vinculos, start=1):
+            if self.check_cancel(): return None
+            Select(driver.find_element(By.XPATH, RHNET_VINCULO_SELECT_XPATH)).select_by_index(vinculo_index)
+            try:
+                options = waiter.until(select_options_changed(RHNET_MATRICULA_SELECT_XPATH, previous_options), f"matrículas do vínculo {vinculo}")
+            except TimeoutException:
+                options = [option.text.strip() for option in Select(driver.find_element(By.XPATH, RHNET_MATRICULA_SELECT_XPATH)).options]
+            previous_options = options
+            for matricula_index, matricula in enumerate(options[1:], start=1):
+                combos.append((vinculo_index, matricula_index, matricula))
+                self.log_message("INFO", f"Vínculo '{vinculo}': matrícula {matricula}")
+        self.log_message("INFO", f"{len(combos)} matrícula(s) encontrada(s) para o CPF.")
+        return combos
+
+    def scrape_all_matriculas(self, driver, waiter, username, password, cpf, combos):
+        """Scrapes every (vínculo index, matrícula index, matrícula) of combos in up to matricula_workers browsers.
+
+        The browser already on the filled form is one of them; the others are borrowed
+        from BROWSER_POOL or started, and released again when no matrícula is left.
+        Returns (driver, result) like scrape_rhnet.
+        """
+        workers = min(len(combos), max(1, read_config_int('RHNet', 'matricula_workers', DEFAULT_MATRICULA_WORKERS)))
+        self.log_message("INFO", f"Extraindo {len(combos)} matrículas com {workers} navegador(es)...")
+        start_time = time.perf_counter()
+        pending = queue.Queue()
+        for index, combo in enumerate(combos):
+            pending.put((index, combo))
+        results = {}
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers - 1))
+        lanes = [executor.submit(self.run_matricula_lane, None, None, username, password, cpf, pending, results)
+                 for _ in range(workers - 1)]
+        driver = self.run_matricula_lane(driver, waiter, username, password, cpf, pending, results, form_filled=True)
+        for lane in lanes:
+            lane_driver = lane.result()
+            if lane_driver is not None and not BROWSER_POOL.release(username, lane_driver):
+                BrowserPool.quit_quietly(lane_driver)
+        executor.shutdown()
+
+        if driver is None or len(results) < len(combos):
             if driver: driver.quit()
             return None, None
+        ordered = [results[index] for index in range(len(combos))]
+        matricula, scraped_data, server_info = ordered[0]
+        for other_matricula, _, other_info in ordered[1:]:
+            self.log_message("INFO", f"Matrícula {other_matricula}: Cargo {other_info['cargo']}, Referência {other_info['referencia']}")
+        self.log_message("INFO", f"Extração do RHNet concluída ({len(combos)} matrículas em {time.perf_counter() - start_time:.1f}s)")
+        return driver, {'data': scraped_data, 'info': server_info,
+                        'matriculas': [(matricula, data) for matricula, data, _ in ordered]}
+
+    def run_matricula_lane(self, driver, waiter, username, password, cpf, pending, results, form_filled=False):
+        """Scrapes queued matrículas with one browser until the queue is empty, storing them in results.
+
+        Starts or borrows its own browser when driver is None. Returns the browser to
+        release, or None after a failure or cancellation (browser quit, run flagged
+        through stage_failed so the other lanes stop). A failure that run_rhnet_stage
+        retries leaves the other lanes running, so their matrículas are saved for the retry.
+        """
+        retrying = False
+        try:
+            while not self.check_cancel():
+                try:
+                    index, (vinculo_index, matricula_index, expected_matricula) = pending.get_nowait()
+                except queue.Empty:
+                    return driver
+                if driver is None:
+                    driver, waiter = self.acquire_rhnet_driver(username, password)
+                    if driver is None: break
+                elif not form_filled and not self.open_ficha_form(driver, waiter):
+                    break
+                if not form_filled and not self.fill_search_form(driver, waiter, cpf):
+                    break
+                form_filled = False
+
+                matricula = self.select_matricula(driver, waiter, vinculo_index, matricula_index, expected_matricula)
+                # The PDF belongs to one vínculo and which one is unknown here, so every matrícula is walked to the end
+                result = self.scrape_selected_matricula(driver, waiter, cpf, matricula, stop_at_pdf=False)
+                if result is None: break
+                results[index] = (matricula,) + result
+                self.log_message("INFO", f"Matrícula {matricula}: {len(result[0]['Date'])} meses extraídos.")
+        except Exception as e:
+            retrying = self.report_rhnet_error(e)
+        if not retrying:
+            self.stage_failed.set()
+        if driver: BrowserPool.quit_quietly(driver)
+        return None
+
+    def fill_search_form(self, driver, waiter, cpf):
+        """Types Órgão and CPF into the empty search form. Returns False on cancellation."""
+        # --- Fill Search Form ---
+        if self.check_cancel(): return False
+        orgao_xpath = '/html/body/form/center[1]/table/tbody/tr[1]/td[2]/input[2]'
+        orgao_textbox = waiter.until(EC.presence_of_element_located((By.XPATH, orgao_xpath)), "campo Órgão")
+        orgao_textbox.send_keys(ORGÃO_RHNET)
+        waiter.until(input_has_value(orgao_textbox, ORGÃO_RHNET), "Órgão preenchido")
+
+        # CPF textbox
+        cpf_xpath = '/html/body/form/center[1]/table/tbody/tr[2]/td[2]/input'
+        cpf_textbox = waiter.until(EC.presence_of_element_located((By.XPATH, cpf_xpath)), "campo CPF")
+        cpf_textbox.send_keys(cpf)
+        waiter.until(input_has_value(cpf_textbox, cpf), "CPF preenchido")
+        return True
+
+    def select_matricula(self, driver, waiter, vinculo_index=1, matricula_index=1, expected_matricula=None):
+        """Picks Tipo Vínculo and Matrícula by option index on the search form. Returns the matrícula text.
+
+        With expected_matricula, waits until the reloaded Matrícula list shows it at matricula_index.
+        """
+        # First Dropdown (Tipo Vínculo) - index 1 is the first real option
+        waiter.until(select_has_options(RHNET_VINCULO_SELECT_XPATH), "lista Tipo Vínculo")
+        select1 = Select(driver.find_element(By.XPATH, RHNET_VINCULO_SELECT_XPATH))
+        select1.select_by_index(vinculo_index)
+
+        # Second Dropdown (Matrícula), reloaded for the chosen vínculo
+        if expected_matricula is None:
+            waiter.until(select_has_options(RHNET_MATRICULA_SELECT_XPATH), "lista Matrícula")
+        else:
+            waiter.until(select_option_is(RHNET_MATRICULA_SELECT_XPATH, matricula_index, expected_matricula), f"matrícula {expected_matricula}")
+        select2 = Select(driver.find_element(By.XPATH, RHNET_MATRICULA_SELECT_XPATH))
+        select2.select_by_index(matricula_index)
+        self.log_message("DEBUG", f"Tempo de espera até o formulário: {waiter.total_seconds:.1f}s em {waiter.steps} etapas.")
+        return select2.first_selected_option.text.strip()
+
+    def scrape_selected_matricula(self, driver, waiter, cpf, matricula, stop_at_pdf=True):
+        """Scrapes the history of the matrícula selected on the filled search form.
+
+        stop_at_pdf stops going back at the months the PDF covers; it is only for the
+        matrícula the PDF belongs to. Returns (scraped_data, server_info), or None on
+        cancellation or when the record cannot be opened (reported). The caller owns the driver.
+        """
+        self.rhnet_walk_started = True # Login and search form worked, so the credentials are good
+        scraped_data = {'Number': [], 'Date': []}
+        server_info = {'nome': 'N/A', 'cargo': 'N/A', 'referencia': 'N/A'}
+        scraping_backend = read_config_option('RHNet', 'scraping_backend', DEFAULT_RHNET_SCRAPING_BACKEND).strip().lower()
+        if scraping_backend not in RHNET_SCRAPING_BACKENDS:
+            self.log_message("WARNING", f"Modo de extração do RHNet inválido '{scraping_backend}'. Usando '{DEFAULT_RHNET_SCRAPING_BACKEND}'.")
+            scraping_backend = DEFAULT_RHNET_SCRAPING_BACKEND
+
+        # --- Months already scraped in earlier runs ---
+        history = None
+        known_dates = set()
+        # With incremental_history = 0 only the checkpoint of an interrupted walk is used
+        incremental = read_config_int('RHNet', 'incremental_history', 1)
+        try:
+            history = RhnetHistoryStore.open(get_rhnet_history_dir(), cpf, matricula, checkpoint_only=not incremental)
+            if incremental:
+                known_dates = history.dates()
+                self.log_message("INFO", f"Histórico local da matrícula {matricula}: {len(known_dates)} meses armazenados.")
+            if history.partial:
+                self.log_message("INFO", f"Retomando a extração interrompida: {len(history.partial)} meses já salvos (até {history.partial[-1][0]}). Eles são pulados e a extração continua a partir do mês seguinte.")
+        except Exception as e:
+            self.log_message("WARNING", f"Não foi possível ler o histórico local do RHNet: {e}")
+
+        # --- Consultar, Detalhar and Recuar as HTTP posts from the filled form ---
+        if scraping_backend == 'http':
+            http_result = self.scrape_history_http(driver, waiter.policy.timeout, known_dates, history, stop_at_pdf)
+            if self.check_cancel(): return None
+            if http_result is not None:
+                scraped_data, server_info = http_result
+                return self.update_rhnet_history(history, scraped_data), server_info
+
+        # --- Click Consultar ---
+        if self.check_cancel(): return None
+        consultar_btn_xpath = '/html/body/form/center[2]/input[1]'
+        waiter.until(EC.element_to_be_clickable((By.XPATH, consultar_btn_xpath)), "botão Consultar").click()
+
+        # --- Select Record and Get Details ---
+        if self.check_cancel(): return None
+        try:
+            # Click checkbox (adjust XPath/ID if needed, 'marca_desmarca' from legacy)
+            checkbox_id = 'marca_desmarca'
+            waiter.until(EC.element_to_be_clickable((By.ID, checkbox_id)), "resultado da consulta").click()
+            waiter.until(EC.element_located_to_be_selected((By.ID, checkbox_id)), "registro selecionado")
+
+            # Click 'Detalhar' button
+            detalhar_btn_xpath = '/html/body/form/center[3]/input[2]'
+            detalhar_button = waiter.until(EC.element_to_be_clickable((By.XPATH, detalhar_btn_xpath)), "botão Detalhar")
+            load_started = time.perf_counter()
+            detalhar_button.click()
+            waiter.until(EC.staleness_of(detalhar_button), "página de detalhes")
+
+        except (TimeoutException, NoSuchElementException) as e:
+            self.log_message("ERROR", f"Não foi possível selecionar ou detalhar o registro do servidor: {e}. Verifique o CPF ou se há registros.")
+            self.result_queue.put(Exception(f"Registro não encontrado/selecionável para CPF {cpf}."))
+            return None
+
+        # --- Extract Server Info (Nome, Cargo, Referência) ---
+        if self.check_cancel(): return None
+        try:
+            waiter.until(EC.visibility_of_element_located((By.XPATH, '/html/body/form/center[1]/table/tbody/tr[4]/td[2]')), "dados do servidor") # Nome element
+
+            nome_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[4]/td[2]')
+            cargo_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[5]/td[2]')
+            referencia_element = driver.find_element(By.XPATH, '/html/body/form/center[1]/table/tbody/tr[6]/td[2]')
+
+            server_info['nome'] = nome_element.text.strip()
+            server_info['cargo'] = cargo_element.text.strip()
+            server_info['referencia'] = referencia_element.text.strip()
+
+            self.log_message("INFO", f"Nome: {server_info['nome']}")
+            self.log_message("INFO", f"Cargo: {server_info['cargo']}")
+            self.log_message("INFO", f"Referência: {server_info['referencia']}")
+
+        except (TimeoutException, NoSuchElementException) as e:
+            self.log_message("WARNING", f"Não foi possível extrair informações detalhadas do servidor (Nome/Cargo/Ref): {e}")
+
+        # --- Scrape Historical Data (Iteratively click "Recuar") ---
+        page_count = 0
+        max_pages = RHNET_MAX_PAGES
+        page_load_times = []
+        previous_date = None
+
+        while page_count < max_pages:
+            page_count += 1
+            if self.check_cancel(): return None
+
+            # Date, VENCIMENTO EFETIVO and Recuar state in one script call, repeated until the page changed
+            try:
+                history_page = waiter.until(history_page_loaded(previous_date), f"pág {page_count}: página do histórico")
+            except TimeoutException:
+                history_page = driver.execute_script(HISTORY_PAGE_SCRIPT, RHNET_DATE_XPATH, RHNET_VENCIMENTO_XPATH, RHNET_RECUAR_XPATH)
+                if previous_date is not None and history_page['date'] == previous_date:
+                    self.log_message("WARNING", f"Pág {page_count}: A página não foi atualizada após clicar em 'Recuar'. Interrompendo.")
+                    break
+            page_load_times.append(time.perf_counter() - load_started)
+            self.log_message("DEBUG", f"Pág {page_count}: carregada e lida em {page_load_times[-1] * 1000:.0f} ms.")
+
+            date_text = history_page['date']
+            if not self.record_history_page(scraped_data, page_count, date_text, history_page['vencimento'], known_dates, history, stop_at_pdf):
+                break
+
+            # Click "Recuar"; the next iteration waits for the new month
+            if history_page['recuar'] is None:
+                self.log_message("INFO", f"Pág {page_count}: Botão 'Recuar' não encontrado. Assumindo fim do histórico.")
+                break
+            if not history_page['recuar']:
+                self.log_message("INFO", f"Pág {page_count}: Botão 'Recuar' está desabilitado. Fim do histórico alcançado.")
+                break
+            previous_date = date_text
+            load_started = time.perf_counter()
+            driver.execute_script(CLICK_XPATH_SCRIPT, RHNET_RECUAR_XPATH)
+
+        if page_count >= max_pages:
+             self.log_message("WARNING", f"Atingido limite máximo de páginas ({max_pages}) ao clicar em 'Recuar'.")
+        self.log_message("INFO", f"Tempo total de espera no RHNet: {waiter.total_seconds:.1f}s em {waiter.steps} etapas.")
+        if page_load_times:
+            self.log_message("INFO", f"Carregamento das páginas do histórico: média {sum(page_load_times) / len(page_load_times) * 1000:.0f} ms, máximo {max(page_load_times) * 1000:.0f} ms ({len(page_load_times)} páginas).")
+        return self.update_rhnet_history(history, scraped_data), server_info
+
+    def record_history_page(self, scraped_data, page_count, date_text, number_text_raw, known_dates=frozenset(), history=None, stop_at_pdf=True):
+        """Validates and stores the date and VENCIMENTO EFETIVO read from one RHNet history page.
+
+        date_text / number_text_raw are None when the element was not found on the page.
+        Returns False, without storing, when the month is in known_dates (already in
+        the local history) or, with stop_at_pdf, already covered by the PDF, so the caller
+        stops going back. A local history truncated at a PDF coverage only stops the walk
+        when this run's PDF covers that month too. With history, each stored row is
+        checkpointed and months checkpointed by a failed walk are skipped.
+        """
+        if date_text in known_dates:
+            truncated_at = history.truncated_at if history is not None else None
+            if truncated_at is None or (stop_at_pdf and self.pdf_covers(truncated_at)):
+                self.log_message("INFO", f"Pág {page_count}: Competência {date_text} já consta no histórico local. Interrompendo 'Recuar'.")
+                if history is not None:
+                    history.walk_stop = 'known'
+                return False
+            self.log_message("DEBUG", f"Pág {page_count}: Competência {date_text} já consta no histórico local, que para em {truncated_at}. Continuando, pois os meses anteriores são necessários.")
+        if history is not None and date_text in history.partial_dates:
+            self.log_message("DEBUG", f"Pág {page_count}: Competência {date_text} já salva na extração interrompida. Pulando.")
+            return True
+        if stop_at_pdf and self.pdf_covers(date_text):
+            year, month = self.pdf_coverage.last_month
+            self.log_message("INFO", f"Pág {page_count}: Competência {date_text} já coberta pelo PDF (até {month:02d}/{year}). Interrompendo 'Recuar'.")
+            if history is not None:
+                history.walk_stop = 'pdf'
+                history.walk_coverage = f"{month:02d}/{year}"
+            return False
+        if date_text is None:
+            self.log_message("WARNING", f"Não foi possível encontrar a data na página {page_count}.")
+            date_text = "N/A"
+        elif not re.match(r"\d{2}/\d{4}", date_text):
+            self.log_message("WARNING", f"Formato de data inesperado na pág {page_count}: '{date_text}'. Tentando continuar.")
+
+        number_text = "" # Empty string when missing, as per legacy logic
+        if number_text_raw is None:
+            self.log_message("DEBUG", f"Pág {page_count} ({date_text}): 'VENCIMENTO EFETIVO' não encontrado ou valor adjacente ausente.")
+        else:
+            # Clean the number (remove R$, convert comma decimal to dot)
+            number_text_raw = number_text_raw.replace("R$", "").strip()
+            if number_text_raw:
+                try:
+                    number_float = locale.atof(number_text_raw)
+                    number_text = f"{number_float:.2f}"
+                    self.log_message("DEBUG", f"Pág {page_count} ({date_text}): Vencimento Efetivo = {number_text_raw} -> {number_text}")
+                except ValueError:
+                    self.log_message("WARNING", f"Pág {page_count} ({date_text}): Não foi possível converter Vencimento Efetivo '{number_text_raw}' para número.")
+
+        # Store extracted data
+        if date_text != "N/A":
+            scraped_data['Number'].append(number_text)
+            scraped_data['Date'].append(date_text)
+            if history is not None:
+                try:
+                    history.checkpoint(date_text, number_text)
+                except OSError as e:
+                    self.log_message("WARNING", f"Pág {page_count}: Não foi possível salvar o ponto de retomada: {e}")
+        else:
+            self.log_message("WARNING", f"Pág {page_count}: Ignorando registro devido à data ausente.")
+        return True
+
+    def pdf_covers(self, date_text):
+        """Tells whether the PDF stage yields the competência date_text ('MM/YYYY').
+
+        Months after the PDF stop never are, so the check is free for most pages. At the
+        boundary it waits for the PDF stage, which normally finished long before, and
+        compares with the last month it yielded ([RHNet] stop_at_pdf_coverage = 0 disables it).
+        """
+        month = parse_competencia(date_text)
+        if month is None or month > (PDF_STOP_YEAR, int(MONTH_NUMBERS_MAP[PDF_STOP_MONTH])):
+            return False
+        coverage = getattr(self, 'pdf_coverage', None)
+        if coverage is None or not read_config_int('RHNet', 'stop_at_pdf_coverage', 1):
+            return False
+        if not coverage.done.is_set():
+            self.log_message("INFO", f"Competência {date_text} alcançada no RHNet. Aguardando a análise do PDF...")
+        while not coverage.done.wait(0.2):
+            if self.check_cancel():
+                return False
+        return coverage.last_month is not None and month <= coverage.last_month
+
+    def update_rhnet_history(self, history, scraped_data):
+        """Merges the stored and checkpointed months into freshly scraped data and saves the result. Returns the merged data."""
+        if history is None:
+            return scraped_data
+        new_months = len(scraped_data['Date'])
+        merged = history.merge(scraped_data)
+        self.log_message("INFO", f"RHNet: {new_months} meses novos, {len(merged['Date']) - new_months} do histórico local.")
+        try:
+            history.save(merged)
+        except Exception as e:
+            self.log_message("WARNING", f"Não foi possível salvar o histórico local do RHNet: {e}")
+        return merged
+
+    def scrape_history_http(self, driver, timeout=SELENIUM_TIMEOUT, known_dates=frozenset(), history=None, stop_at_pdf=True):
+        """Runs Consultar, Detalhar and the Recuar loop as HTTP posts, starting from the filled search form.
+
+        Uses the browser's session cookies; the browser itself is left on the search form.
+        Going back stops at the first month in known_dates (or covered by the PDF, with
+        stop_at_pdf); rows are checkpointed in history (see record_history_page). Returns (scraped_data, server_info), or None to fall back
+        to the browser when a page does not look as expected (or on cancellation).
+        """
+        scraped_data = {'Number': [], 'Date': []}
+        server_info = {'nome': 'N/A', 'cargo': 'N/A', 'referencia': 'N/A'}
+        start_time = time.perf_counter()
+        try:
+            client = RhnetHttpClient.from_driver(driver, timeout)
+            page = client.snapshot(driver)
+            page = client.submit(page, RHNET_CONSULTAR_XPATH)
+            if self.check_cancel(): return None
+            page = client.submit(page, RHNET_DETALHAR_XPATH, check_all=True)
+
+            for row, key in ((4, 'nome'), (5, 'cargo'), (6, 'referencia')):
+                cells = page.xpath(RHNET_INFO_XPATH.format(row))
+                if cells:
+                    server_info[key] = cells[0].text_content().strip()
+            self.log_message("INFO", f"Nome: {server_info['nome']}")
+            self.log_message("INFO", f"Cargo: {server_info['cargo']}")
+            self.log_message("INFO", f"Referência: {server_info['referencia']}")
+
+            previous_date = None
+            for page_count in range(1, RHNET_MAX_PAGES + 1):
+                if self.check_cancel(): return None
+                date_text, number_text_raw, recuar_enabled = read_history_page(page)
+                if date_text is None or not re.match(r"\d{2}/\d{4}", date_text):
+                    raise ValueError(f"data não encontrada na página {page_count}")
+                if date_text == previous_date:
+                    raise ValueError(f"'Recuar' não mudou de mês na página {page_count}")
+                previous_date = date_text
+                if not self.record_history_page(scraped_data, page_count, date_text, number_text_raw, known_dates, history, stop_at_pdf):
+                    break
+
+                if not recuar_enabled:
+                    self.log_message("INFO", f"Pág {page_count}: Botão 'Recuar' está desabilitado ou ausente. Fim do histórico alcançado.")
+                    break
+                page = client.submit(page, RHNET_RECUAR_XPATH)
+            else:
+                self.log_message("WARNING", f"Atingido limite máximo de páginas ({RHNET_MAX_PAGES}) ao clicar em 'Recuar'.")
+        except (requests.RequestException, ValueError, IndexError, WebDriverException) as e:
+            self.log_message("WARNING", f"Extração do RHNet via HTTP falhou ({e}). Continuando pelo navegador.")
+            return None
+
+        self.log_message("INFO", f"{len(scraped_data['Date'])} meses lidos do RHNet via HTTP em {time.perf_counter() - start_time:.1f}s.")
+        return scraped_data, server_info
 
     def generate_html(self, pivot_table, server_info):
         """Generates the HTML output file."""
@@ -1270,60 +3216,7 @@ class CalculadoraCHApp:
 
             self.log_message("INFO", f"Salvando tabela de CH em: {html_file_path}")
 
-            title = "CÁLCULO DA MÉDIA DE CARGA HORÁRIA ANUAL"
-            nome_safe = html.escape(server_info.get('nome', 'N/A'))
-            cargo_safe = html.escape(server_info.get('cargo', 'N/A'))
-            ref_safe = html.escape(server_info.get('referencia', 'N/A'))
-            title2 = f"NOME: {nome_safe}<br>CARGO: {cargo_safe}<br>REFERENCIA: {ref_safe}"
-
-            with open(html_file_path, 'w', encoding='utf-8') as f:
-                f.write('<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n')
-                f.write('<meta charset="UTF-8">\n')
-                f.write('<meta name="viewport" content="width=device-width, initial-scale=1.0">\n')
-                f.write('<title>Cálculo CH</title>\n')
-                f.write('<style>\n')
-                f.write('  body { font-family: sans-serif; margin: 20px; }\n')
-                f.write('  h1 { text-align: center; color: #333; }\n')
-                f.write('  h3 { color: #555; border-bottom: 1px solid #ccc; padding-bottom: 10px; margin-bottom: 20px; }\n')
-                f.write('  table { border-collapse: collapse; width: 100%; font-size: 12px; text-align: center; margin-top: 15px; }\n')
-                f.write('  th, td { border: 1px solid #ccc; padding: 6px 8px; }\n')
-                f.write('  th { background-color: #f2f2f2; font-weight: bold; }\n')
-                f.write('  td.year-header { font-weight: bold; background-color: #f8f8f8; text-align: center; }\n')
-                f.write('  tr:nth-child(even) { background-color: #fafafa; }\n')
-                f.write('</style>\n</head>\n<body>\n')
-
-                f.write(f'<h1>{title}</h1>\n')
-                f.write(f'<h3>{title2}</h3>\n')
-
-                f.write('<table>\n')
-                f.write('<thead>\n<tr><th>Ano</th>')
-                for month in pivot_table.columns:
-                    f.write(f'<th>{month}</th>')
-                f.write('</tr>\n</thead>\n')
-
-                f.write('<tbody>\n')
-                for year in pivot_table.index:
-                    f.write(f'<tr><td class="year-header">{year}</td>')
-                    for month in pivot_table.columns:
-                        value_str = str(pivot_table.loc[year, month]).strip()
-                        value_display = ""
-                        if value_str:
-                            try:
-                                value_float = float(value_str)
-                                value_display = str(int(value_float))
-                            except ValueError:
-                                if value_str.isdigit():
-                                    value_display = value_str
-                                else:
-                                    value_display = value_str if value_str == "-" else "" 
-
-                        value_safe = html.escape(value_display)
-                        f.write(f'<td>{value_safe}</td>')
-                    f.write('</tr>\n')
-                f.write('</tbody>\n')
-
-                f.write('</table>\n')
-                f.write('</body>\n</html>\n')
+            write_html_report(html_file_path, pivot_table, server_info)
 
             self.log_message("INFO", "Tabela de CH gerada com sucesso.")
             try:
@@ -1344,10 +3237,258 @@ class CalculadoraCHApp:
             self.log_message("ERROR", traceback.format_exc())
             self.result_queue.put(Exception(f"Erro ao gerar/salvar HTML: {e}"))
 
+# --- Batch Mode ---
+
+class BatchCalculation(CalculadoraCHApp):
+    """One servidor of a --lote run: the GUI pipeline without Tk, saving the report to a fixed path."""
+
+    def __init__(self, cpf, report_path, cancel_requested, log):
+        self.cpf = cpf
+        self.report_path = report_path
+        self.log = log
+        super().__init__(None) # The locale is set once by run_batch
+        self.cancel_requested = cancel_requested # Shared by the whole batch
+
+    def log_message(self, level, message):
+        self.log(level, f"CPF {self.cpf}: {message}")
+
+    def generate_html(self, pivot_table, server_info):
+        try:
+            write_html_report(self.report_path, pivot_table, server_info)
+        except Exception as e:
+            self.log_message("ERROR", f"Erro ao gerar ou salvar arquivo HTML: {e}")
+            self.result_queue.put(Exception(f"Erro ao gerar/salvar HTML: {e}"))
+            return
+        self.log_message("INFO", f"Tabela de CH salva em: {self.report_path}")
+        self.result_queue.put("SUCCESS")
+
+class BatchLog:
+    """Thread-safe log of a batch run: everything goes to the log file, INFO and above also to the console."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, level, message):
+        log_entry = f"{time.strftime('%H:%M:%S')} [{level}]: {message}"
+        with self.lock:
+            self.file.write(log_entry + "\n")
+            self.file.flush()
+            if level != "DEBUG":
+                print(log_entry)
+
+    def close(self):
+        self.file.close()
+
+def read_batch_manifest(manifest_path):
+    """Reads the (cpf, pdf) rows of a batch manifest: a CSV (',' or ';') with 'cpf' and 'pdf' columns.
+
+    Relative PDF paths are taken from the manifest's folder.
+    """
+    with open(manifest_path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;')
+        reader = csv.DictReader(f, dialect=dialect)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+        if 'cpf' not in columns or 'pdf' not in columns:
+            raise ValueError(f"O manifesto deve ter as colunas 'cpf' e 'pdf' (encontradas: {reader.fieldnames})")
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        jobs = []
+        for row in reader:
+            cpf = (row[columns['cpf']] or '').strip()
+            pdf_path = (row[columns['pdf']] or '').strip()
+            if cpf and pdf_path:
+                jobs.append((cpf, os.path.join(base_dir, pdf_path)))
+        return jobs
+
+class KeyedLocks:
+    """One lock per key, created on first use. holding() takes several keys in sorted order, so it cannot deadlock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @contextlib.contextmanager
+    def holding(self, keys):
+        with self.lock:
+            locks = [self.locks.setdefault(key, threading.Lock()) for key in sorted(set(keys))]
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+def batch_job_keys(cpf, pdf_path):
+    """Returns the keys of the files a batch job writes: the CPF's RHNet history and the PDF's cache entry."""
+    try:
+        pdf_key = get_file_signature(pdf_path)['sha256']
+    except OSError:
+        pdf_key = os.path.normcase(os.path.abspath(pdf_path))
+    return [('cpf', re.sub(r'\D', '', cpf)), ('pdf', pdf_key)]
+
+def run_batch_job(cpf, pdf_path, username, password, output_dir, retries, cancel_requested, log, job_locks, report_name=None):
+    """Runs the calculation of one servidor, retrying failures. Returns its row of the batch summary.
+
+    Jobs sharing a CPF or a PDF wait for each other through job_locks, since they write
+    the same RHNet history/checkpoint and PDF cache files.
+    """
+    report_path = os.path.join(output_dir, report_name or f"Calculo_CH_{re.sub(r'[^0-9A-Za-z]', '', cpf)}.html")
+    with job_locks.holding(batch_job_keys(cpf, pdf_path)):
+        return run_batch_attempts(cpf, pdf_path, username, password, report_path, retries, cancel_requested, log)
+
+def run_batch_attempts(cpf, pdf_path, username, password, report_path, retries, cancel_requested, log):
+    """Calculates one servidor up to retries + 1 times. Returns its row of the batch summary."""
+    start_time = time.perf_counter()
+    outcome = None
+    for attempt in range(1, retries + 2):
+        if cancel_requested.is_set():
+            outcome = "CANCELLED"
+            break
+        if not os.path.exists(pdf_path):
+            outcome = Exception(f"Arquivo PDF não encontrado: {pdf_path}")
+            break
+        calculation = BatchCalculation(cpf, report_path, cancel_requested, log)
+        calculation.log_message("INFO", f"Iniciando cálculo (tentativa {attempt} de {retries + 1})...")
+        calculation.run_calculation_thread(username, password, cpf, pdf_path)
+        try:
+            outcome = calculation.result_queue.get_nowait()
+        except queue.Empty:
+            outcome = Exception("cálculo terminou sem resultado")
+        if outcome == "SUCCESS" or outcome == "CANCELLED":
+            break
+        if calculation.rhnet_failed_before_walk:
+            calculation.log_message("WARNING", f"Falha no login ou no formulário do RHNet ({outcome}). Sem nova tentativa, para não bloquear a conta.")
+            break
+        if attempt <= retries and not cancel_requested.is_set():
+            delay = BATCH_RETRY_DELAY * 2 ** (attempt - 1)
+            calculation.log_message("WARNING", f"Tentativa {attempt} falhou ({outcome}). Nova tentativa em {delay}s.")
+            cancel_requested.wait(delay)
+
+    if outcome == "SUCCESS":
+        status = "OK"
+    elif outcome == "CANCELLED":
+        status = "CANCELADO"
+    else:
+        status = "ERRO"
+    return {
+        'cpf': cpf, 'pdf': pdf_path, 'situacao': status, 'tentativas': attempt,
+        'segundos': f"{time.perf_counter() - start_time:.1f}",
+        'relatorio': report_path if status == "OK" else '',
+        'erro': str(outcome) if status == "ERRO" else '',
+    }
+
+def run_batch(manifest_path, username, password, output_dir, workers, retries):
+    """Calculates the CH table of every servidor in the manifest without the GUI. Returns the number of failures.
+
+    Up to workers servidores run at once, each with the usual concurrent PDF / RHNet
+    stages. The browser pool keeps one logged-in RHNet browser per worker between
+    servidores. A failed servidor is retried and never stops the others; timings and
+    outcomes go to BATCH_SUMMARY_FILE in output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    log = BatchLog(os.path.join(output_dir, 'lote.log'))
+    cancel_requested = threading.Event()
+    try:
+        jobs = read_batch_manifest(manifest_path)
+        log("INFO", f"Lote '{manifest_path}': {len(jobs)} servidores, {workers} em paralelo, até {retries} nova(s) tentativa(s).")
+        locale_warning = set_pt_br_locale()
+        if locale_warning:
+            log("WARNING", locale_warning)
+
+        # Load every year sheet once, so the workers only read the salary table cache
+        if BatchCalculation('-', None, cancel_requested, log).load_salary_table(range(FIRST_PDF_YEAR, PDF_STOP_YEAR + 1)) is None:
+            log("ERROR", f"Não foi possível carregar a tabela de vencimentos: {EXCEL_FILE_PATH}")
+            return len(jobs)
+        BROWSER_POOL.max_idle = max(BROWSER_POOL.max_idle, workers)
+
+        start_time = time.perf_counter()
+        summary = []
+        job_locks = KeyedLocks()
+        report_names = []
+        cpf_rows = {}
+        for cpf, _ in jobs: # A CPF listed again gets its own report, e.g. Calculo_CH_123_2.html
+            cpf_key = re.sub(r'[^0-9A-Za-z]', '', cpf)
+            cpf_rows[cpf_key] = cpf_rows.get(cpf_key, 0) + 1
+            report_names.append(f"Calculo_CH_{cpf_key}.html" if cpf_rows[cpf_key] == 1 else f"Calculo_CH_{cpf_key}_{cpf_rows[cpf_key]}.html")
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(run_batch_job, cpf, pdf_path, username, password, output_dir, retries, cancel_requested, log,
+                                   job_locks, report_name)
+                   for (cpf, pdf_path), report_name in zip(jobs, report_names)]
+        try:
+            for future in futures:
+                summary.append(future.result())
+        except KeyboardInterrupt:
+            log("WARNING", "Interrompido pelo usuário. Cancelando os cálculos em andamento...")
+            cancel_requested.set()
+            summary = [future.result() for future in futures]
+        executor.shutdown()
+
+        summary_path = os.path.join(output_dir, BATCH_SUMMARY_FILE)
+        with open(summary_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=list(summary[0]) if summary else ['cpf'], delimiter=';')
+            writer.writeheader()
+            writer.writerows(summary)
+        failures = sum(1 for row in summary if row['situacao'] != "OK")
+        log("INFO", f"Lote concluído em {time.perf_counter() - start_time:.1f}s: {len(summary) - failures} OK, {failures} com falha. Resumo: {summary_path}")
+        return failures
+    finally:
+        log.close()
+
+def parse_command_line(argv=None):
+    """Parses the command-line options. Without options the GUI is started."""
+    parser = argparse.ArgumentParser(description="Calculadora de Carga Horária (CH).")
+    parser.add_argument('--compilar-tabela', action='store_true',
+                        help="Compila o Excel de vencimentos em uma tabela colunar e sai, sem abrir a interface.")
+    parser.add_argument('--excel', metavar='ARQUIVO',
+                        help="Excel de vencimentos a compilar (padrão: excel_file_path do config.ini).")
+    parser.add_argument('--saida', metavar='ARQUIVO',
+                        help="Arquivo da tabela compilada (padrão: cache ao lado do config.ini ou compiled_table_path).")
+    parser.add_argument('--limpar-cache', action='store_true',
+                        help="Apaga o cache de análises de PDF (fichas financeiras) e sai.")
+    parser.add_argument('--limpar-historico', action='store_true',
+                        help="Apaga o histórico local de meses já extraídos do RHNet e sai.")
+    parser.add_argument('--lote', metavar='MANIFESTO',
+                        help="Calcula, sem a interface, a tabela de cada servidor do CSV (colunas 'cpf' e 'pdf').")
+    parser.add_argument('--login', help="Login do RHNet para o lote (a senha vem de RHNET_SENHA ou é pedida no terminal).")
+    parser.add_argument('--pasta-saida', metavar='PASTA', default='resultados_lote',
+                        help="Pasta dos relatórios, do log e do resumo do lote (padrão: resultados_lote).")
+    parser.add_argument('--trabalhadores', type=int, metavar='N',
+                        default=read_config_int('Batch', 'workers', DEFAULT_BATCH_WORKERS),
+                        help=f"Servidores calculados ao mesmo tempo no lote (padrão: {DEFAULT_BATCH_WORKERS}).")
+    parser.add_argument('--tentativas', type=int, metavar='N',
+                        default=read_config_int('Batch', 'retries', DEFAULT_BATCH_RETRIES),
+                        help=f"Novas tentativas para um servidor com falha (padrão: {DEFAULT_BATCH_RETRIES}).")
+    return parser.parse_args(argv)
+
 # --- Main execution ---
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed by the PDF process pool in frozen Windows builds
+    args = parse_command_line()
+    if args.compilar_tabela:
+        excel_path = args.excel or EXCEL_FILE_PATH
+        if not excel_path or not os.path.exists(excel_path):
+            print(f"Arquivo Excel de vencimentos não encontrado: {excel_path}")
+            sys.exit(1)
+        compile_salary_table(excel_path, args.saida or get_salary_cache_path())
+        sys.exit(0)
+    if args.limpar_cache:
+        pdf_cache_dir = get_pdf_cache_dir()
+        print(f"{ParsedPdfCache(pdf_cache_dir).clear()} análises de PDF removidas de '{pdf_cache_dir}'.")
+        sys.exit(0)
+    if args.limpar_historico:
+        history_dir = get_rhnet_history_dir()
+        print(f"{RhnetHistoryStore.clear(history_dir)} históricos do RHNet removidos de '{history_dir}'.")
+        sys.exit(0)
+
     if EXCEL_FILE_PATH is None:
         sys.exit(1)
+    if args.lote:
+        if not args.login:
+            print("Informe o login do RHNet com --login.")
+            sys.exit(1)
+        password = os.environ.get('RHNET_SENHA') or getpass.getpass("Senha RHNet: ")
+        failures = run_batch(args.lote, args.login, password, args.pasta_saida, max(1, args.trabalhadores), max(0, args.tentativas))
+        sys.exit(1 if failures else 0)
     try:
         root = ThemedTk(theme="vista")
     except Exception: